@@ -0,0 +1,171 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Column, DateTime, Index, Integer, Table, func, select, text, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Base, engine
+from models import APProject, Invoice, POToVendor, Transaction
+
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('APAR_ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('APAR_ARCHIVE_BATCH_SIZE', 200))
+
+# Settled (is_paid) and deleted projects that have not changed for
+# ARCHIVE_AFTER_DAYS are moved, with their POs, invoices and transactions, out
+# of the hot tables into archived_* copies of them. Pages, writes and reports
+# read the hot tables unless asked to include archived rows, which goes through
+# with_archived(); read_archived_project() serves /ap/archive, and the duplicate
+# payment and vendor PO checks always read the archive (see ARCHIVE_LOOKUPS).
+# archive_id grows with every archived row, so max(archive_id) tells cached
+# pages that rows have left the hot tables.
+# Archived rows keep their ids, which is why the hot tables are AUTOINCREMENT
+# and never hand an archived id out again.
+HOT_TABLES = [APProject.__table__, POToVendor.__table__, Invoice.__table__, Transaction.__table__]
+
+# Columns still looked up once archived: a DV reference stays paid and a
+# vendor PO number stays taken after its project is archived.
+ARCHIVE_LOOKUPS = {'transactions': ['dv_reference'], 'po_to_vendor': ['vendor_po']}
+
+
+def _archive_table(table: Table):
+    archived = Table(
+        f"archived_{table.name}", Base.metadata,
+        Column('archive_id', Integer, primary_key=True),
+        *(Column(column.name, column.type, nullable=column.nullable) for column in table.columns),
+        Column('archived_at', DateTime, server_default=func.now()),
+    )
+    Index(f"ix_archived_{table.name}_id", archived.c.id, unique=True)
+    if 'project_id' in archived.c:
+        Index(f"ix_archived_{table.name}_project_id", archived.c.project_id)
+    for column in ARCHIVE_LOOKUPS.get(table.name, []):
+        Index(f"ix_archived_{table.name}_{column}", archived.c[column])
+    return archived
+
+
+ARCHIVE_TABLES = {table.name: _archive_table(table) for table in HOT_TABLES}
+ARCHIVED_PROJECTS = ARCHIVE_TABLES['ap_projects']
+
+# Settled rows are found through ix_ap_projects_settled_updated_at, whose WHERE
+# clause this repeats so SQLite can use the partial index.
+ARCHIVE_CANDIDATES_QUERY = text(
+    "INSERT INTO temp.archive_batch (id) "
+    "SELECT id FROM ap_projects WHERE (is_deleted = 1 OR is_paid = 1) AND updated_at < :cutoff "
+    "ORDER BY updated_at LIMIT :batch_size"
+)
+
+
+def with_archived(model):
+    # The hot table and its archive as one selectable with the hot table's
+    # columns, for aliased(model, ...) in the explicit include-archived mode.
+    table = model.__table__
+    archived = ARCHIVE_TABLES[table.name]
+    return union_all(
+        select(*table.columns),
+        select(*(archived.c[column.name] for column in table.columns)),
+    ).subquery(f"{table.name}_with_archived")
+
+
+def archive_cutoff(days: int):
+    # updated_at is stored as naive UTC (SQLite's CURRENT_TIMESTAMP).
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def archive_batch(connection: Connection, cutoff: str, batch_size: int = ARCHIVE_BATCH_SIZE):
+    # Moves up to batch_size projects in the caller's transaction and returns
+    # the rows moved per table. Every statement is keyed on the batch's
+    # project ids through the project_id indexes, so a batch holds the write
+    # lock for about as long as a payment run of the same size.
+    connection.execute(text("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)"))
+    connection.execute(text("DELETE FROM temp.archive_batch"))
+    if not connection.execute(ARCHIVE_CANDIDATES_QUERY, {"cutoff": cutoff, "batch_size": batch_size}).rowcount:
+        return {}
+
+    moved = {}
+    for table in HOT_TABLES:
+        key = 'id' if table.name == 'ap_projects' else 'project_id'
+        columns = ', '.join(column.name for column in table.columns)
+        connection.execute(text(
+            f"INSERT INTO {ARCHIVE_TABLES[table.name].name} ({columns}) "
+            f"SELECT {columns} FROM {table.name} WHERE {key} IN (SELECT id FROM temp.archive_batch) ORDER BY id"
+        ))
+
+    # Children first; the ledger and search triggers clean up after each row.
+    for table in reversed(HOT_TABLES):
+        key = 'id' if table.name == 'ap_projects' else 'project_id'
+        moved[table.name] = connection.execute(text(
+            f"DELETE FROM {table.name} WHERE {key} IN (SELECT id FROM temp.archive_batch)"
+        )).rowcount
+
+    connection.execute(text("DELETE FROM project_ledger WHERE project_id IN (SELECT id FROM temp.archive_batch)"))
+    connection.execute(text(
+        "DELETE FROM vendor_po_ledger WHERE vendor_po_id IN (SELECT id FROM archived_po_to_vendor "
+        "WHERE project_id IN (SELECT id FROM temp.archive_batch))"
+    ))
+    return moved
+
+
+def archive_projects(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE, pause: float = 0.05,
+                     progress=None):
+    # One transaction per batch, with a pause in between so page renders and
+    # payments queue behind at most one batch.
+    cutoff = archive_cutoff(days)
+    totals = dict.fromkeys((table.name for table in HOT_TABLES), 0)
+    while True:
+        with engine.begin() as connection:
+            moved = archive_batch(connection, cutoff, batch_size)
+        if not moved:
+            return totals
+        for table, count in moved.items():
+            totals[table] += count
+        if progress:
+            progress(totals)
+        time.sleep(pause)
+
+
+async def read_archived_project(db: AsyncSession, project_id: int):
+    project = (await db.execute(
+        select(ARCHIVED_PROJECTS).where(ARCHIVED_PROJECTS.c.id == project_id)
+    )).mappings().first()
+    if project is None:
+        return None
+
+    record = dict(project)
+    for name, table in (("vendor_pos", 'po_to_vendor'), ("invoices", 'invoices'), ("transactions", 'transactions')):
+        archived = ARCHIVE_TABLES[table]
+        record[name] = [dict(row) for row in (await db.execute(
+            select(archived).where(archived.c.project_id == project_id).order_by(archived.c.id)
+        )).mappings()]
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move settled and deleted projects out of the hot tables.")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="only projects unchanged for this many days")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="projects moved per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to wait between batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count the projects that would be moved")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        with engine.connect() as connection:
+            count = connection.execute(text(
+                "SELECT count(*) FROM ap_projects WHERE (is_deleted = 1 OR is_paid = 1) AND updated_at < :cutoff"
+            ), {"cutoff": archive_cutoff(args.older_than_days)}).scalar()
+        print(f"{count} projects would be archived")
+        return
+
+    started = time.perf_counter()
+    totals = archive_projects(args.older_than_days, args.batch_size, args.pause,
+                              progress=lambda totals: print(f"{totals['ap_projects']} projects archived",
+                                                            file=sys.stderr))
+    for table, count in totals.items():
+        print(f"{table:>14}: {count:>10,}")
+    print(f"archived in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
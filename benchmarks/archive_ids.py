@@ -0,0 +1,176 @@
+"""Regression check for the ids of archived rows.
+
+Archived rows keep the id they had in the hot table, so the hot tables must
+never hand that id out again. Archives the newest projects, which hold the
+highest ids of every hot table, records a new project with a vendor PO,
+invoice and payment through the app, then settles and archives that one too,
+and checks that the new rows got fresh ids and that no id appears twice
+across a hot table and its archive. Finally tries to reuse the archived DV
+reference and vendor PO number, through the importer and the app, on an open
+project; every attempt must be refused.
+
+    python benchmarks/archive_ids.py --transactions 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A negative age puts the cutoff in the future, so every settled project
+# qualifies however recently it changed.
+ANY_AGE = -1
+
+
+def highest_ids(connection):
+    from sqlalchemy import text
+    from archive import ARCHIVE_TABLES
+
+    return {name: connection.execute(text(
+        f"SELECT max((SELECT coalesce(max(id), 0) FROM {name}), (SELECT coalesce(max(id), 0) FROM {archived.name}))"
+    )).scalar() for name, archived in ARCHIVE_TABLES.items()}
+
+
+async def record_project():
+    import httpx
+    from sqlalchemy import text
+    from database import async_engine
+    from main import app
+
+    statuses = []
+    ids = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check") as client:
+        async def post(url, data, table, lookup, value):
+            response = await client.post(url, data={**data, "user_id": "1"})
+            statuses.append(response.status_code)
+            async with async_engine.connect() as connection:
+                ids[table] = (await connection.execute(text(f"SELECT id FROM {table} WHERE {lookup} = :value"),
+                                                       {"value": value})).scalar()
+
+        await post("/ap/add-project", {"client": "Archive Check", "quotation": "QKPH-ARCHIVE", "acceptance": "AKPH-ARCHIVE",
+                                       "currency": "PHP", "total_po_amount": "100"},
+                   "ap_projects", "quotation", "QKPH-ARCHIVE")
+        project_id = ids["ap_projects"]
+        await post(f"/ap/add-vendor-po/{project_id}", {"vendor_po": "PKPH-ARCHIVE", "vendor": "Archive Vendor",
+                                                       "po_amount": "100"},
+                   "po_to_vendor", "vendor_po", "PKPH-ARCHIVE")
+        await post(f"/ap/record-invoice/{project_id}", {"vendor_po_id": str(ids["po_to_vendor"]), "invoice_type": "INV",
+                                                        "invoice_number": "INV-ARCHIVE", "invoice_amount": "100"},
+                   "invoices", "invoice_number", "INV-ARCHIVE")
+        await post(f"/ap/add-transaction/{project_id}", {"invoice_id": str(ids["invoices"]), "transaction_amount": "100",
+                                                         "dv_reference": "DV-ARCHIVE", "date_paid": "2026-01-02"},
+                   "transactions", "dv_reference", "DV-ARCHIVE")
+    await async_engine.dispose()
+    return statuses, ids
+
+
+async def reuse_references(project_id, invoice_id):
+    import httpx
+    from database import async_engine
+    from main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check") as client:
+        vendor_po = await client.post(f"/ap/add-vendor-po/{project_id}", data={
+            "vendor_po": "PKPH-ARCHIVE", "vendor": "Archive Vendor", "po_amount": "1", "user_id": "1"})
+        payment = await client.post(f"/ap/add-transaction/{project_id}", data={
+            "invoice_id": str(invoice_id), "transaction_amount": "1", "dv_reference": "DV-ARCHIVE",
+            "date_paid": "2026-02-03", "user_id": "1"})
+    await async_engine.dispose()
+    return vendor_po.status_code, payment.status_code
+
+
+def import_references(connection, project_id, invoice_id):
+    import io
+    from sqlalchemy import text
+    from importer import import_csv
+
+    open_invoice = connection.execute(text(
+        "SELECT p.quotation, v.vendor_po, i.invoice_number FROM invoices AS i "
+        "JOIN po_to_vendor AS v ON v.id = i.vendor_po_id JOIN ap_projects AS p ON p.id = i.project_id "
+        "WHERE i.id = :id"), {"id": invoice_id}).one()
+    vendor_pos = import_csv(io.StringIO(
+        "quotation,vendor_po,vendor,po_amount\n"
+        f"{open_invoice.quotation},PKPH-ARCHIVE,Archive Vendor,1\n"), "vendor_pos", 1)
+    transactions = import_csv(io.StringIO(
+        "vendor_po,invoice_number,transaction_amount,dv_reference,date_paid\n"
+        f"{open_invoice.vendor_po},{open_invoice.invoice_number},1,DV-ARCHIVE,2026-02-03\n"), "transactions", 1)
+    return vendor_pos["imported"], transactions["imported"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=2000, help="size of the generated dataset")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["APAR_DATABASE_PATH"] = os.path.join(directory, "archive.db")
+        from sqlalchemy import text
+        from database import engine
+        from migrations import migrate
+        from benchmarks.datagen import generate
+        from archive import ARCHIVE_TABLES, archive_projects
+
+        migrate(engine)
+        generate(engine, args.transactions, args.seed)
+
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE ap_projects SET is_paid = 1 WHERE id > (SELECT max(id) - 5 FROM ap_projects)"))
+            high_water = highest_ids(connection)
+        archive_projects(days=ANY_AGE, pause=0)
+        with engine.connect() as connection:
+            newest_left = connection.execute(text("SELECT max(id) FROM ap_projects")).scalar()
+
+        statuses, new_ids = asyncio.run(record_project())
+
+        with engine.connect() as connection:
+            settled = connection.execute(text("SELECT is_paid FROM ap_projects WHERE id = :id"),
+                                         {"id": new_ids["ap_projects"]}).scalar()
+        try:
+            second_run = archive_projects(days=ANY_AGE, pause=0)
+            archive_error = None
+        except Exception as error:
+            second_run, archive_error = {}, error
+
+        with engine.connect() as connection:
+            repeated = {name: connection.execute(text(
+                f"SELECT count(*) - count(DISTINCT id) FROM (SELECT id FROM {name} UNION ALL SELECT id FROM {archived.name})"
+            )).scalar() for name, archived in ARCHIVE_TABLES.items()}
+            # An open project with an invoice that can still take a payment.
+            open_project_id, open_invoice_id = connection.execute(text(
+                "SELECT i.project_id, i.id FROM invoices AS i JOIN ap_projects AS p ON p.id = i.project_id "
+                "WHERE i.is_deleted = 0 AND p.is_paid = 0 AND p.balance >= 1 AND i.invoice_amount - coalesce("
+                "(SELECT sum(transaction_amount) FROM transactions AS t WHERE t.invoice_id = i.id AND t.is_deleted = 0), 0) >= 1 "
+                "LIMIT 1")).one()
+        with engine.connect() as connection:
+            imported = import_references(connection, open_project_id, open_invoice_id)
+        reused = asyncio.run(reuse_references(open_project_id, open_invoice_id))
+        engine.dispose()
+
+    checks = {
+        "newest projects archived": newest_left < high_water["ap_projects"],
+        "new rows recorded through the app": statuses == [201] * 4,
+        "new project settled by its payment": settled == 1,
+        **{f"new {name} id past every archived id": new_ids.get(name) is not None and new_ids[name] > high_water[name]
+           for name in high_water},
+        "new project archived": archive_error is None and second_run.get("ap_projects") == 1,
+        **{f"no {name} id both hot and archived": not count for name, count in repeated.items()},
+        "archived vendor PO number refused by the app": reused[0] == 409,
+        "archived DV reference refused by the app": reused[1] == 409,
+        "archived vendor PO number refused by the importer": imported[0] == 0,
+        "archived DV reference refused by the importer": imported[1] == 0,
+    }
+
+    print(f"highest ids before archiving {high_water}, new ids {new_ids}")
+    if archive_error is not None:
+        print(f"second archive run failed: {archive_error}")
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
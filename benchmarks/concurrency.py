@@ -0,0 +1,146 @@
+"""Concurrent-request throughput benchmark for the AP app.
+
+Seeds a throwaway SQLite database, then drives the app in-process through an
+ASGI client with many concurrent page and API readers while a probe keeps
+hitting /healthy. A blocking data layer shows up as low throughput and a
+health-check latency that tracks the slowest query.
+
+Save a run and compare later runs of the same tree against it, e.g. before
+and after a change to the data layer:
+
+    python benchmarks/concurrency.py --output before.json
+    python benchmarks/concurrency.py --output after.json --compare before.json
+
+It needs APAR_DATABASE_PATH and migrations.py, so it cannot run against
+revisions older than those.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(project_count: int):
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, first_name, last_name, hashed_password, is_active, role, team, is_deleted) "
+            "VALUES (1, 'bench', 'bench@example.com', 'Bench', 'User', '-', 1, 'admin', 'ap', 0)"
+        ))
+        connection.execute(text(
+            "INSERT INTO ap_projects (created_by_id, modified_by_id, client, quotation, acceptance, currency, "
+            "total_po_amount, total_paid, balance, is_paid, is_deleted) "
+            "VALUES (1, 1, :client, :quotation, :acceptance, 'PHP', 1000000, 0, 1000000, 0, 0)"
+        ), [
+            {"client": f"Client {i % 50}", "quotation": f"QKPH-{i:06d}", "acceptance": f"AKPH-{i:06d}"}
+            for i in range(project_count)
+        ])
+        connection.execute(text(
+            "INSERT INTO po_to_vendor (project_id, created_by_id, modified_by_id, vendor_po, vendor, po_amount, "
+            "balance, currency, is_paid, is_deleted) "
+            "SELECT id, 1, 1, 'PKPH-' || id, 'Vendor ' || (id % 20), 1000000, 1000000, 'PHP', 0, 0 FROM ap_projects"
+        ))
+        connection.execute(text(
+            "INSERT INTO invoices (project_id, vendor_po_id, created_by_id, modified_by_id, invoice_type, "
+            "invoice_number, invoice_amount, currency, is_paid, is_deleted) "
+            "SELECT project_id, id, 1, 1, 'INV', 'INV-' || id, 1000, 'PHP', 0, 0 FROM po_to_vendor"
+        ))
+
+
+async def run(concurrency: int, duration: float, project_count: int):
+    import httpx
+    from database import async_engine
+    from main import app
+
+    latencies, probe_latencies = [], []
+    deadline = time.perf_counter() + duration
+    transport = httpx.ASGITransport(app=app)
+    routes = [
+        ("/ap/", {"limit": 200}),
+        ("/ap/projects", {"limit": 200}),
+        ("/ap/search", {"q": "QKPH-00"}),
+        ("/ap/details/{project_id}", {}),
+        ("/ap/vendor-po-details-page/{project_id}", {}),
+    ]
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(number: int):
+            request = 0
+            while time.perf_counter() < deadline:
+                path, params = routes[(number + request) % len(routes)]
+                project_id = (number * 7919 + request) % project_count + 1
+                request += 1
+                started = time.perf_counter()
+                await client.get(path.format(project_id=project_id), params=params)
+                latencies.append(time.perf_counter() - started)
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.get("/healthy")
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)), probe())
+        elapsed = time.perf_counter() - started
+
+    await async_engine.dispose()
+
+    def percentile(values, pct):
+        return statistics.quantiles(values, n=100)[pct - 1] * 1000 if len(values) > 1 else 0.0
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "request_p50_ms": percentile(latencies, 50),
+        "request_p95_ms": percentile(latencies, 95),
+        "healthy_p95_ms": percentile(probe_latencies, 95),
+        "healthy_max_ms": max(probe_latencies, default=0.0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--projects", type=int, default=5000)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["APAR_DATABASE_PATH"] = os.path.join(directory, "bench.db")
+        from database import engine
+        from migrations import migrate
+        migrate(engine)
+        seed(args.projects)
+        results = asyncio.run(run(args.concurrency, args.duration, args.projects))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    for key, value in results.items():
+        line = f"{key:>16}: {value:10.2f}"
+        if baseline and key in baseline and baseline[key]:
+            line += f"   (was {baseline[key]:10.2f}, x{value / baseline[key]:.2f})"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Synthetic AP data generator.
+
+Builds project -> vendor PO -> invoice -> transaction trees that look like the
+real ledger: a few vendor POs per project, invoices that split each PO,
+payments that settle invoices in one to three instalments, some open
+balances, a couple of currencies and a small share of soft-deleted records.
+Generation stops once the requested number of transactions exists, so the
+same command scales from 1k to 1M transactions. A fixed seed gives the same
+data on every run.
+
+The per-row search, version and ledger triggers are dropped for the load and
+the search index and ledger snapshots are rebuilt afterwards in one pass,
+which keeps 1M transactions to about a minute and a half.
+
+    python benchmarks/datagen.py --transactions 100000 --database /tmp/ap-100k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INSERT_BATCH_SIZE = 20000
+USER_COUNT = 5
+DELETED_SHARE = 0.02
+START_DATE = datetime(2024, 1, 1, 8, 0)
+DATE_SPAN_DAYS = 900
+
+CLIENTS = [f"{prefix} {suffix}" for prefix in ("Apex", "Banyan", "Cobalt", "Delta", "Evergreen", "Fulcrum",
+                                               "Granite", "Harbor", "Isla", "Juniper", "Kestrel", "Luzon")
+           for suffix in ("Holdings", "Builders", "Logistics", "Telecom", "Retail", "Energy")]
+VENDORS = [f"{prefix} {suffix}" for prefix in ("Acme", "Bright", "Core", "Dyna", "Eastwind", "Forge", "Globe",
+                                               "Hilltop", "Ion", "Jade")
+           for suffix in ("Supply", "Systems", "Trading", "Services", "Networks")]
+INVOICE_TYPES = ["Sales Invoice", "Service Invoice", "Billing Statement", "Official Receipt"]
+CURRENCIES = [("PHP", 0.8), ("USD", 0.2)]
+
+
+def timestamp(value: datetime):
+    # Same text layout SQLAlchemy's SQLite DateTime type writes.
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def split_amount(rng: random.Random, total: float, parts: int):
+    if parts == 1:
+        return [total]
+    weights = [rng.uniform(0.5, 1.5) for _ in range(parts)]
+    amounts = [round(total * weight / sum(weights), 2) for weight in weights[:-1]]
+    return amounts + [round(total - sum(amounts), 2)]
+
+
+class Generator:
+    def __init__(self, connection, seed: int):
+        self.connection = connection
+        self.rng = random.Random(seed)
+        self.ids = {"ap_projects": 0, "po_to_vendor": 0, "invoices": 0, "transactions": 0}
+        self.rows = {table: [] for table in self.ids}
+        self.counts = dict.fromkeys(self.ids, 0)
+
+    def next_id(self, table: str):
+        self.ids[table] += 1
+        return self.ids[table]
+
+    def add(self, table: str, row: tuple):
+        self.rows[table].append(row)
+        self.counts[table] += 1
+        if len(self.rows[table]) >= INSERT_BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table: str):
+        rows = self.rows[table]
+        if rows:
+            self.connection.exec_driver_sql(
+                f"INSERT INTO {table} ({COLUMNS[table]}) VALUES ({', '.join('?' * len(rows[0]))})", rows
+            )
+            rows.clear()
+
+    def flush_all(self):
+        for table in self.rows:
+            self.flush(table)
+
+    def project(self):
+        rng = self.rng
+        project_id = self.next_id("ap_projects")
+        user_id = rng.randint(1, USER_COUNT)
+        created = START_DATE + timedelta(days=rng.uniform(0, DATE_SPAN_DAYS))
+        currency = rng.choices([code for code, _ in CURRENCIES], [share for _, share in CURRENCIES])[0]
+        deleted = rng.random() < DELETED_SHARE
+
+        total_po_amount = 0.0
+        total_paid = 0.0
+        for _ in range(rng.choice((1, 1, 2, 2, 3, 4, 6))):
+            po_amount = round(rng.uniform(5000, 2000000 if currency == "PHP" else 40000), 2)
+            total_po_amount += po_amount
+            total_paid += self.vendor_po(project_id, user_id, created, currency, po_amount, deleted)
+
+        # Most projects are quoted above what has been ordered from vendors so far.
+        if rng.random() < 0.7:
+            total_po_amount *= rng.uniform(1.0, 1.3)
+        total_po_amount = round(total_po_amount, 2)
+        total_paid = round(total_paid, 2)
+        balance = round(total_po_amount - total_paid, 2)
+        self.add("ap_projects", (
+            project_id, user_id, user_id, rng.choice(CLIENTS),
+            f"QKPH-{created:%y%m}-{project_id:06d}", f"AKPH-{project_id:09d}", currency,
+            total_po_amount, total_paid, balance, balance == 0, deleted, project_id,
+            timestamp(created), timestamp(created),
+        ))
+
+    def vendor_po(self, project_id: int, user_id: int, created: datetime, currency: str, po_amount: float,
+                  deleted: bool):
+        rng = self.rng
+        vendor_po_id = self.next_id("po_to_vendor")
+        deleted = deleted or rng.random() < DELETED_SHARE
+        ordered = created + timedelta(days=rng.uniform(0, 30))
+
+        # Most POs are fully invoiced; the rest are still waiting on a bill.
+        invoiced = po_amount if rng.random() < 0.85 else round(po_amount * rng.uniform(0.3, 0.9), 2)
+        paid = 0.0
+        for invoice_amount in split_amount(rng, invoiced, rng.choice((1, 1, 2, 3, 4))):
+            paid += self.invoice(project_id, vendor_po_id, user_id, ordered, currency, invoice_amount, deleted)
+
+        balance = round(po_amount - paid, 2)
+        self.add("po_to_vendor", (
+            vendor_po_id, project_id, user_id, user_id, f"PKPH-{vendor_po_id:09d}", rng.choice(VENDORS),
+            po_amount, balance, currency, balance == 0, deleted, timestamp(ordered), timestamp(ordered),
+        ))
+        return paid
+
+    def invoice(self, project_id: int, vendor_po_id: int, user_id: int, ordered: datetime, currency: str,
+                invoice_amount: float, deleted: bool):
+        rng = self.rng
+        invoice_id = self.next_id("invoices")
+        deleted = deleted or rng.random() < DELETED_SHARE
+        billed = ordered + timedelta(days=rng.uniform(1, 60))
+
+        roll = rng.random()
+        if roll < 0.6:
+            payments = split_amount(rng, invoice_amount, 1)
+        elif roll < 0.85:
+            payments = split_amount(rng, invoice_amount, rng.choice((2, 3)))
+        elif roll < 0.95:
+            # Partly paid: the last instalment is still outstanding.
+            payments = split_amount(rng, invoice_amount, rng.choice((2, 3)))[:-1]
+        else:
+            payments = []
+
+        paid_on = billed
+        for amount in payments:
+            paid_on += timedelta(days=rng.uniform(5, 45))
+            transaction_id = self.next_id("transactions")
+            self.add("transactions", (
+                transaction_id, project_id, invoice_id, vendor_po_id, user_id, amount,
+                timestamp(paid_on.replace(hour=0, minute=0, second=0, microsecond=0)),
+                f"DV{transaction_id:09d}", deleted, timestamp(paid_on), timestamp(paid_on),
+            ))
+
+        self.add("invoices", (
+            invoice_id, project_id, vendor_po_id, user_id, user_id, rng.choice(INVOICE_TYPES),
+            f"SI-{invoice_id:08d}", invoice_amount, currency, round(sum(payments), 2) == invoice_amount,
+            deleted, timestamp(billed), timestamp(billed),
+        ))
+        # Soft-deleted payments are not part of the ledger.
+        return 0.0 if deleted else sum(payments)
+
+
+COLUMNS = {
+    "ap_projects": "id, created_by_id, modified_by_id, client, quotation, acceptance, currency, total_po_amount, "
+                   "total_paid, balance, is_paid, is_deleted, version, created_at, updated_at",
+    "po_to_vendor": "id, project_id, created_by_id, modified_by_id, vendor_po, vendor, po_amount, balance, "
+                    "currency, is_paid, is_deleted, created_at, updated_at",
+    "invoices": "id, project_id, vendor_po_id, created_by_id, modified_by_id, invoice_type, invoice_number, "
+                "invoice_amount, currency, is_paid, is_deleted, created_at, updated_at",
+    "transactions": "id, project_id, invoice_id, vendor_po_id, created_by_id, transaction_amount, date_paid, "
+                    "dv_reference, is_deleted, created_at, updated_at",
+}
+
+
+def generate(engine, transactions: int, seed: int = 0):
+    # Expects a migrated, empty database. Returns the row count per table.
+    from ledger import rebuild_snapshots
+    from migrations import create_triggers
+
+    with engine.begin() as connection:
+        triggers = [row.name for row in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        )]
+        for name in triggers:
+            connection.exec_driver_sql(f"DROP TRIGGER {name}")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, username, email, first_name, last_name, hashed_password, is_active, role, team, "
+            "is_deleted) VALUES (?, ?, ?, ?, 'Bench', '-', 1, ?, 'ap', 0)",
+            [(i, f"ap{i}", f"ap{i}@example.com", f"Clerk {i}", "admin" if i == 1 else "clerk")
+             for i in range(1, USER_COUNT + 1)],
+        )
+
+        generator = Generator(connection, seed)
+        while generator.counts["transactions"] < transactions:
+            generator.project()
+        generator.flush_all()
+        rebuild_snapshots(connection)
+        connection.exec_driver_sql("ANALYZE")
+
+    # Recreates the triggers and backfills the search index in one pass.
+    create_triggers(engine)
+    return generator.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", required=True, help="SQLite file to create; must not exist yet")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        parser.error(f"{args.database} already exists")
+    os.environ["APAR_DATABASE_PATH"] = args.database
+
+    from database import engine
+    from migrations import migrate
+
+    migrate(engine)
+    started = time.perf_counter()
+    counts = generate(engine, args.transactions, args.seed)
+    engine.dispose()
+
+    for table, count in counts.items():
+        print(f"{table:>14}: {count:>10,}")
+    print(f"generated in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
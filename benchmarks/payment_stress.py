@@ -0,0 +1,122 @@
+"""Concurrency stress check for payment balance updates.
+
+Seeds a throwaway SQLite database with one project and vendor PO and an
+invoice per payment, then posts many payments at once to /ap/add-transaction, each confirmed as
+not a duplicate of the others, and checks that
+the stored balances match exactly what the accepted payments add up to. The
+payments deliberately overdraw the PO so the "balance >= amount" guard is
+exercised too.
+
+    python benchmarks/payment_stress.py --payments 200 --amount 7.25
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(balance: Decimal, invoices: int):
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, first_name, last_name, hashed_password, is_active, role, team, is_deleted) "
+            "VALUES (1, 'stress', 'stress@example.com', 'Stress', 'User', '-', 1, 'admin', 'ap', 0)"
+        ))
+        connection.execute(text(
+            "INSERT INTO ap_projects (id, created_by_id, modified_by_id, client, quotation, acceptance, currency, "
+            "total_po_amount, total_paid, balance, is_paid, is_deleted) "
+            "VALUES (1, 1, 1, 'Stress Client', 'QKPH-STRESS-01', 'AKPH-STRESS-01', 'PHP', :balance, 0, :balance, 0, 0)"
+        ), {"balance": float(balance)})
+        connection.execute(text(
+            "INSERT INTO po_to_vendor (id, project_id, created_by_id, modified_by_id, vendor_po, vendor, po_amount, "
+            "balance, currency, is_paid, is_deleted) "
+            "VALUES (1, 1, 1, 1, 'PKPH-STRESS', 'Stress Vendor', :balance, :balance, 'PHP', 0, 0)"
+        ), {"balance": float(balance)})
+        connection.execute(text(
+            "INSERT INTO invoices (id, project_id, vendor_po_id, created_by_id, modified_by_id, invoice_type, "
+            "invoice_number, invoice_amount, currency, is_paid, is_deleted) "
+            "VALUES (:id, 1, 1, 1, 1, 'INV', :invoice_number, :balance, 'PHP', 0, 0)"
+        ), [{"id": i, "invoice_number": f"INV-STRESS-{i}", "balance": float(balance)} for i in range(1, invoices + 1)])
+
+
+async def run(payments: int, amount: Decimal):
+    import httpx
+    from sqlalchemy import select, func
+    from database import AsyncSessionLocal, async_engine
+    from main import app
+    from models import APProject, POToVendor, Transaction
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stress") as client:
+        responses = await asyncio.gather(*(client.post("/ap/add-transaction/1", data={
+            "invoice_id": str(number + 1),
+            "transaction_amount": str(amount),
+            "dv_reference": f"DV-{number:08d}",
+            "date_paid": date.today().isoformat(),
+            "confirm_duplicate": "true",
+            "user_id": "1",
+        }) for number in range(payments)))
+    accepted = sum(response.status_code == 201 for response in responses)
+    unexpected = sorted({response.status_code for response in responses} - {201, 422})
+
+    async with AsyncSessionLocal() as db:
+        project = await db.get(APProject, 1)
+        vendor_po = await db.get(POToVendor, 1)
+        ledger_total = await db.scalar(select(func.coalesce(func.sum(Transaction.transaction_amount), 0)))
+        ledger_count = await db.scalar(select(func.count(Transaction.id)))
+
+    await async_engine.dispose()
+    return accepted, unexpected, project, vendor_po, Decimal(str(ledger_total)), ledger_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--amount", type=Decimal, default=Decimal("7.25"))
+    args = parser.parse_args()
+
+    # Room for roughly three quarters of the payments, so the rest must be refused.
+    starting_balance = args.amount * (args.payments * 3 // 4)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["APAR_DATABASE_PATH"] = os.path.join(directory, "stress.db")
+        from database import engine
+        from migrations import migrate
+        migrate(engine)
+        seed(starting_balance, args.payments)
+        accepted, unexpected, project, vendor_po, ledger_total, ledger_count = asyncio.run(run(args.payments, args.amount))
+
+        from ledger import find_drift
+        with engine.connect() as connection:
+            drift = find_drift(connection).all()
+        engine.dispose()
+
+    expected_paid = args.amount * accepted
+    expected_balance = starting_balance - expected_paid
+    checks = {
+        "only over-balance payments refused": not unexpected,
+        "accepted payments fit the balance": accepted == args.payments * 3 // 4,
+        "one ledger row per accepted payment": ledger_count == accepted,
+        "ledger total": ledger_total == expected_paid,
+        "project balance": Decimal(project.balance) == expected_balance,
+        "project total_paid": Decimal(project.total_paid) == expected_paid,
+        "vendor PO balance": Decimal(vendor_po.balance) == expected_balance,
+        "paid flags": project.is_paid == vendor_po.is_paid == (expected_balance == 0),
+        "balances reconcile with the ledger snapshots": not drift,
+    }
+
+    print(f"{accepted} of {args.payments} payments accepted, balance {project.balance} (expected {expected_balance})")
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
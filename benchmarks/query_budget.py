@@ -0,0 +1,133 @@
+"""Per-page SQL query budget check for the AP app.
+
+Seeds a throwaway SQLite database twice, once with a single vendor PO, invoice
+and transaction per project and once with many, then renders every page through
+the app and counts the statements it runs. A page that lazy-loads per row shows
+up as a count that grows with the data; any page over its budget fails the run.
+
+    python benchmarks/query_budget.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROJECT_COUNT = 20
+
+# Cached pages run one version query and, on a cache miss, the page queries.
+QUERY_BUDGETS = {
+    "/ap/": 1,
+    "/ap/projects": 2,
+    "/ap/projects/rows": 2,
+    "/ap/search?q=QKPH": 1,
+    "/ap/search-results?q=QKPH": 1,
+    "/ap/details/1": 3,
+    "/ap/add-vendor-po-page/1": 2,
+    "/ap/add-transaction-page/1": 3,
+    "/ap/transaction-history-page/1": 3,
+    "/ap/record-invoice-page/1": 3,
+    "/ap/vendor-po-details-page/1": 2,
+    "/ap/dashboard": 2,
+    "/ap/dashboard/data": 2,
+    "/ap/batch-payment-page?vendor=Vendor": 2,
+}
+
+
+def seed(children: int):
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.begin() as connection:
+        for table in ("transactions", "invoices", "po_to_vendor", "ap_projects", "users"):
+            connection.execute(text(f"DELETE FROM {table}"))
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, first_name, last_name, hashed_password, is_active, role, team, is_deleted) "
+            "VALUES (1, 'bench', 'bench@example.com', 'Bench', 'User', '-', 1, 'admin', 'ap', 0)"
+        ))
+        connection.execute(text(
+            "INSERT INTO ap_projects (id, created_by_id, modified_by_id, client, quotation, acceptance, currency, "
+            "total_po_amount, total_paid, balance, is_paid, is_deleted) "
+            "VALUES (:id, 1, 1, :client, :quotation, :acceptance, 'PHP', 1000000, 0, 1000000, 0, 0)"
+        ), [
+            {"id": i, "client": f"Client {i}", "quotation": f"QKPH-{i:06d}", "acceptance": f"AKPH-{i:06d}"}
+            for i in range(1, PROJECT_COUNT + 1)
+        ])
+        connection.execute(text(
+            "INSERT INTO po_to_vendor (id, project_id, created_by_id, modified_by_id, vendor_po, vendor, po_amount, "
+            "balance, currency, is_paid, is_deleted) "
+            "VALUES (:id, :project_id, 1, 1, :vendor_po, 'Vendor', 1000, 1000, 'PHP', 0, 0)"
+        ), [
+            {"id": i * children + n + 1, "project_id": i % PROJECT_COUNT + 1, "vendor_po": f"PKPH-{i}-{n}"}
+            for i in range(PROJECT_COUNT) for n in range(children)
+        ])
+        connection.execute(text(
+            "INSERT INTO invoices (id, project_id, vendor_po_id, created_by_id, modified_by_id, invoice_type, "
+            "invoice_number, invoice_amount, currency, is_paid, is_deleted) "
+            "SELECT id, project_id, (project_id - 1) * :children + 1, 1, 1, 'INV', 'INV-' || id, 100, 'PHP', 0, 0 "
+            "FROM po_to_vendor"
+        ), {"children": children})
+        connection.execute(text(
+            "INSERT INTO transactions (project_id, invoice_id, vendor_po_id, created_by_id, transaction_amount, "
+            "date_paid, dv_reference, is_deleted) "
+            "SELECT project_id, id, vendor_po_id, 1, 10, '2026-01-01 00:00:00.000000', 'DV-' || id, 0 FROM invoices"
+        ))
+
+
+async def count_page_queries(app):
+    import httpx
+    from database import count_queries
+
+    counts = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://budget") as client:
+        for path in QUERY_BUDGETS:
+            with count_queries() as statements:
+                response = await client.get(path)
+            response.raise_for_status()
+            counts[path] = len(statements)
+    return counts
+
+
+async def run(sizes: list):
+    from database import async_engine, engine
+    from main import app
+    from migrations import migrate
+
+    # ASGITransport does not run the lifespan, so apply the schema here.
+    migrate(engine)
+    results = {}
+    try:
+        for children in sizes:
+            seed(children)
+            results[children] = await count_page_queries(app)
+    finally:
+        await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 50],
+                        help="vendor POs, invoices and transactions seeded per project")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["APAR_DATABASE_PATH"] = os.path.join(directory, "budget.db")
+        results = asyncio.run(run(args.sizes))
+
+    failed = False
+    print(f"{'path':<36}{'budget':>8}" + "".join(f"{f'n={size}':>8}" for size in args.sizes))
+    for path, budget in QUERY_BUDGETS.items():
+        counts = [results[size][path] for size in args.sizes]
+        over = any(count > budget for count in counts)
+        failed = failed or over
+        print(f"{path:<36}{budget:>8}" + "".join(f"{count:>8}" for count in counts) + ("  OVER" if over else ""))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Query plan check for the AP app.
+
+Generates a large throwaway SQLite database, drives every page and write
+endpoint through the app while recording the SQL it issues, then runs
+EXPLAIN QUERY PLAN on each statement with the parameters it was sent. Any
+statement that reads a table with a full scan instead of an index fails the
+run. Reports and the ledger-wide duplicate scan aggregate the whole ledger by
+design and are not checked.
+
+    python benchmarks/query_plans.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A bare "SCAN <table>" reads every row; "SCAN <table> USING [COVERING] INDEX"
+# walks an index in order (the keyset-paginated project list does this) and is fine.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+GET_PATHS = [
+    "/ap/",
+    "/ap/?cursor={cursor}",
+    "/ap/projects",
+    "/ap/projects?currency=PHP&is_paid=false&client=Client%201",
+    "/ap/projects/rows?cursor={cursor}",
+    "/ap/search?q=QKPH-000042",
+    "/ap/search-results?q=Vendor",
+    "/ap/details/{project_id}",
+    "/ap/add-vendor-po-page/{project_id}",
+    "/ap/add-transaction-page/{project_id}",
+    "/ap/transaction-history-page/{project_id}",
+    "/ap/record-invoice-page/{project_id}",
+    "/ap/vendor-po-details-page/{vendor_po_id}",
+]
+
+
+def seed(project_count: int, children: int):
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, first_name, last_name, hashed_password, is_active, role, team, is_deleted) "
+            "VALUES (1, 'bench', 'bench@example.com', 'Bench', 'User', '-', 1, 'admin', 'ap', 0)"
+        ))
+        # Every tenth row is soft-deleted so the partial indexes have something to leave out.
+        connection.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count) "
+            "INSERT INTO ap_projects (created_by_id, modified_by_id, client, quotation, acceptance, currency, "
+            "total_po_amount, total_paid, balance, is_paid, is_deleted, created_at) "
+            "SELECT 1, 1, 'Client ' || (i % 50), printf('QKPH-%06d', i), printf('AKPH-%06d', i), 'PHP', "
+            "100000000, 0, 100000000, 0, i % 10 = 0, datetime('2025-01-01', '+' || (i / 10) || ' minutes') FROM n"
+        ), {"count": project_count})
+        connection.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :children) "
+            "INSERT INTO po_to_vendor (project_id, created_by_id, modified_by_id, vendor_po, vendor, po_amount, "
+            "balance, currency, is_paid, is_deleted) "
+            "SELECT p.id, 1, 1, 'PKPH-' || p.id || '-' || i, 'Vendor ' || (p.id % 20), 1000000, 1000000, 'PHP', 0, "
+            "i % 10 = 0 FROM ap_projects AS p, n"
+        ), {"children": children})
+        connection.execute(text(
+            "INSERT INTO invoices (project_id, vendor_po_id, created_by_id, modified_by_id, invoice_type, "
+            "invoice_number, invoice_amount, currency, is_paid, is_deleted) "
+            "SELECT project_id, id, 1, 1, 'INV', 'INV-' || id, 1000, 'PHP', 0, is_deleted FROM po_to_vendor"
+        ))
+        connection.execute(text(
+            "INSERT INTO transactions (project_id, invoice_id, vendor_po_id, created_by_id, transaction_amount, "
+            "date_paid, dv_reference, is_deleted) "
+            "SELECT project_id, id, vendor_po_id, 1, 10, datetime('2026-01-01', '+' || (id % 365) || ' days'), "
+            "'DV-' || id, is_deleted FROM invoices"
+        ))
+        connection.execute(text("ANALYZE"))
+        return connection.execute(text(
+            "SELECT p.id, min(v.id) FROM ap_projects AS p JOIN po_to_vendor AS v ON v.project_id = p.id "
+            "WHERE p.is_deleted = 0 AND v.is_deleted = 0 GROUP BY p.id ORDER BY p.id DESC LIMIT 1"
+        )).one()
+
+
+async def capture_statements(app, project_id: int, vendor_po_id: int):
+    import httpx
+    from sqlalchemy import event, select
+    from database import async_engine
+    from models import Invoice
+
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "WITH"):
+            statements.setdefault(statement, parameters)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://plans") as client:
+        cursor = (await client.get("/ap/?limit=5")).headers["X-Next-Cursor"]
+        async with async_engine.connect() as connection:
+            invoice_id = (await connection.execute(
+                select(Invoice.id).filter(Invoice.vendor_po_id == vendor_po_id)
+            )).scalar_one()
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            for path in GET_PATHS:
+                response = await client.get(path.format(cursor=cursor, project_id=project_id,
+                                                         vendor_po_id=vendor_po_id))
+                response.raise_for_status()
+
+            # Writes run up to their inserts; whether the insert succeeds doesn't matter here.
+            await client.post("/ap/add-project", data={
+                "client": "Plan", "quotation": "QKPH-PLAN", "acceptance": "AKPH-PLAN",
+                "currency": "PHP", "total_po_amount": "100", "user_id": "1",
+            })
+            await client.post(f"/ap/add-vendor-po/{project_id}", data={
+                "vendor_po": "PKPH-PLAN", "vendor": "Plan", "po_amount": "100", "user_id": "1",
+            })
+            await client.post(f"/ap/record-invoice/{project_id}", data={
+                "vendor_po_id": str(vendor_po_id), "invoice_type": "INV", "invoice_number": "INV-PLAN",
+                "invoice_amount": "100", "user_id": "1",
+            })
+            await client.post(f"/ap/add-transaction/{project_id}", data={
+                "invoice_id": str(invoice_id), "transaction_amount": "1", "dv_reference": "DV-PLAN",
+                "date_paid": "2026-03-01", "confirm_duplicate": "true", "user_id": "1",
+            })
+            await client.put(f"/ap/delete-project/{project_id}")
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+    return statements
+
+
+def explain(statements: dict):
+    from database import engine
+
+    plans = {}
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in statements.items():
+            rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            plans[statement] = [row[-1] for row in rows]
+    finally:
+        connection.close()
+    return plans
+
+
+async def run(project_count: int, children: int):
+    from database import async_engine, engine
+    from main import app
+    from migrations import migrate
+
+    # ASGITransport does not run the lifespan, so apply the schema here.
+    migrate(engine)
+    project_id, vendor_po_id = seed(project_count, children)
+    try:
+        return await capture_statements(app, project_id, vendor_po_id)
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=20000)
+    parser.add_argument("--children", type=int, default=5,
+                        help="vendor POs, invoices and transactions generated per project")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not just the failing ones")
+    args = parser.parse_args()
+    # Generating the dataset trips the slow query log; the plans are what matter here.
+    logging.getLogger("apar.sql").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["APAR_DATABASE_PATH"] = os.path.join(directory, "plans.db")
+        statements = asyncio.run(run(args.projects, args.children))
+        plans = explain(statements)
+
+    failures = 0
+    for statement, plan in plans.items():
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        failures += bool(scans)
+        if scans or args.verbose:
+            print(("FULL SCAN  " if scans else "ok         ") + " ".join(statement.split()))
+            for step in plan:
+                print(f"           {step}")
+
+    print(f"{len(plans)} statements checked, {failures} with a full table scan")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
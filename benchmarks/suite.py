@@ -0,0 +1,368 @@
+"""End-to-end benchmark suite for the AP app.
+
+Generates (or copies) a synthetic dataset, then drives every route in main.py
+and routers/accounts_payable.py through an in-process ASGI client. Each route
+gets a fixed number of requests at a fixed concurrency, spread over randomly
+chosen live projects, vendor POs and invoices, and reports p50/p95/p99
+latency, throughput and the peak Python allocation of a single request.
+Reads run before writes so the write routes don't change what the reads see.
+
+Save a run as the baseline, then compare later runs against it; any route
+that got slower, lost throughput or needs more memory than the tolerance
+allows, or fails more requests than before, is flagged and the run exits
+non-zero. Routes where every request failed get no latency or throughput
+numbers, since they would only time the error responses.
+
+    python benchmarks/suite.py --transactions 100000 --output baseline.json
+    python benchmarks/suite.py --transactions 100000 --compare baseline.json
+
+Generating 1M transactions takes about a minute and a half; generate once with
+benchmarks/datagen.py and pass --database to reuse it (it is copied first).
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MEMORY_SAMPLES = 3
+# Settled and deleted projects untouched since then are archived before the
+# run, as the archive job would, so the archive routes have rows to read. A
+# fixed date keeps the archived set the same from run to run.
+ARCHIVE_CUTOFF = '2025-07-01 00:00:00'
+BATCH_PAYMENT_SIZE = 20
+REPLAYED_REQUEST = 99999
+
+# Higher is worse for every metric except throughput. p99 is reported but not
+# compared; at a few hundred requests per route it is a handful of samples.
+COMPARED_METRICS = {"p50_ms": 1, "p95_ms": 1, "throughput_rps": -1, "peak_alloc_kib": 1}
+
+
+def get(path: str, **params):
+    return "GET", path, {"params": params} if params else {}
+
+
+def import_file(kind: str, n: int, token: str):
+    rows = "\n".join(f"Import Client,QKPH-I{token}{n:04d}{i:03d},AKPH-I{n:04d}{i:03d},PHP,{1000 + i}"
+                     for i in range(100))
+    body = f"client,quotation,acceptance,currency,total_po_amount\n{rows}\n"
+    return "POST", f"/ap/import/{kind}", {"files": {"file": ("projects.csv", io.BytesIO(body.encode()))},
+                                         "data": {"user_id": "1"}}
+
+
+def batch_payment(sample, n: int):
+    # A cent on each of BATCH_PAYMENT_SIZE invoices from one vendor, dated a day
+    # apart per request so runs never repeat an exact (invoice, amount, date).
+    vendor = sample.choice(sample.vendors)
+    invoices = sample.sample(sample.vendor_invoices[vendor], min(BATCH_PAYMENT_SIZE, len(sample.vendor_invoices[vendor])))
+    return "POST", "/ap/batch-payment", {"data": {
+        "user_id": "1", "vendor": vendor, "invoice_id": [str(invoice) for invoice in invoices],
+        "transaction_amount": ["0.01"] * len(invoices),
+        "dv_reference": [f"R{sample.token}{n:05d}{i:03d}" for i in range(len(invoices))],
+        "date_paid": (date(2026, 1, 1) + timedelta(days=n)).isoformat(), "confirm_duplicate": "true"}}
+
+
+def replayed(route: str):
+    # The same request under one Idempotency-Key every time: the first one runs
+    # the route, every later one is answered from the idempotency store.
+    def build(sample, n: int):
+        if route not in sample.replays:
+            method, url, kwargs = ROUTES[route](sample, REPLAYED_REQUEST)
+            sample.replays[route] = method, url, {**kwargs, "headers": {"Idempotency-Key": f"suite-{sample.token}-{route}"}}
+        return sample.replays[route]
+    return build
+
+
+# name -> builds the n-th request from a sample of live ids. Reports read the
+# whole ledger, so they get a fraction of the requests the pages get.
+ROUTES = {
+    "GET /": lambda s, n: get("/"),
+    "GET /healthy": lambda s, n: get("/healthy"),
+    "GET /metrics": lambda s, n: get("/metrics"),
+    "GET /static/js/htmx.min.js": lambda s, n: get("/static/js/htmx.min.js"),
+    "GET /ap/": lambda s, n: get("/ap/", limit=50),
+    "GET /ap/?include_archived=true": lambda s, n: get("/ap/", limit=50, include_archived="true"),
+    "GET /ap/archive/{id}": lambda s, n: get(f"/ap/archive/{s.choice(s.archived_projects)}"),
+    "GET /ap/projects": lambda s, n: get("/ap/projects"),
+    "GET /ap/projects/rows": lambda s, n: get("/ap/projects/rows", client=s.choice(s.clients)),
+    "GET /ap/details/{id}": lambda s, n: get(f"/ap/details/{s.choice(s.projects)}"),
+    "GET /ap/add-project-page": lambda s, n: get("/ap/add-project-page"),
+    "GET /ap/add-vendor-po-page/{id}": lambda s, n: get(f"/ap/add-vendor-po-page/{s.choice(s.projects)}"),
+    "GET /ap/add-transaction-page/{id}": lambda s, n: get(f"/ap/add-transaction-page/{s.choice(s.projects)}"),
+    "GET /ap/transaction-history-page/{id}": lambda s, n: get(f"/ap/transaction-history-page/{s.choice(s.projects)}"),
+    "GET /ap/record-invoice-page/{id}": lambda s, n: get(f"/ap/record-invoice-page/{s.choice(s.projects)}"),
+    "GET /ap/vendor-po-details-page/{id}": lambda s, n: get(f"/ap/vendor-po-details-page/{s.choice(s.vendor_pos)[0]}"),
+    "GET /ap/search": lambda s, n: get("/ap/search", q=s.choice(s.search_terms)),
+    "GET /ap/search-results": lambda s, n: get("/ap/search-results", q=s.choice(s.search_terms)),
+    "GET /ap/dashboard": lambda s, n: get("/ap/dashboard"),
+    "GET /ap/dashboard/data": lambda s, n: get("/ap/dashboard/data"),
+    "GET /ap/batch-payment-page": lambda s, n: get("/ap/batch-payment-page", vendor=s.choice(s.vendors)),
+    "GET /ap/reports/ledger": lambda s, n: get("/ap/reports/ledger"),
+    "GET /ap/reports/project": lambda s, n: get("/ap/reports/project"),
+    "GET /ap/reports/vendor": lambda s, n: get("/ap/reports/vendor"),
+    "GET /ap/reports/aging": lambda s, n: get("/ap/reports/aging"),
+    "GET /ap/reports/duplicates": lambda s, n: get("/ap/reports/duplicates"),
+    "GET /ap/reports/ledger?format=xlsx": lambda s, n: get("/ap/reports/ledger", format="xlsx"),
+    "GET /ap/reports/ledger?include_archived=true": lambda s, n: get("/ap/reports/ledger", include_archived="true"),
+    "POST /ap/add-project": lambda s, n: ("POST", "/ap/add-project", {"data": {
+        "client": "Bench Client", "quotation": f"QKPH-B{s.token}{n:06d}", "acceptance": f"AKPH-B{n:08d}",
+        "currency": "PHP", "total_po_amount": "500000", "user_id": "1"}}),
+    "POST /ap/add-vendor-po/{id}": lambda s, n: ("POST", f"/ap/add-vendor-po/{s.choice(s.open_projects)}", {"data": {
+        "vendor_po": f"PKB{s.token}{n:07d}", "vendor": "Bench Vendor", "po_amount": "1.00", "user_id": "1"}}),
+    "POST /ap/record-invoice/{id}": lambda s, n: (lambda vendor_po: (
+        "POST", f"/ap/record-invoice/{vendor_po[1]}", {"data": {
+            "vendor_po_id": str(vendor_po[0]), "invoice_type": "Sales Invoice",
+            "invoice_number": f"SI-B{s.token}{n:06d}", "invoice_amount": "0.01", "user_id": "1"}}))(s.choice(s.vendor_pos)),
+    "POST /ap/add-transaction/{id}": lambda s, n: (lambda invoice: (
+        "POST", f"/ap/add-transaction/{invoice[1]}", {"data": {
+            "invoice_id": str(invoice[0]), "transaction_amount": "0.01", "dv_reference": f"B{s.token}{n:06d}",
+            # A different day per request, so a random invoice picked twice isn't an exact duplicate.
+            "date_paid": f"2026-{1 + n % 12:02d}-{1 + n // 12 % 28:02d}", "confirm_duplicate": "true",
+            "user_id": "1"}}))(s.choice(s.invoices)),
+    "POST /ap/batch-payment": lambda s, n: batch_payment(s, n),
+    "POST /ap/batch-payment (replayed)": replayed("POST /ap/batch-payment"),
+    "POST /ap/import/projects": lambda s, n: import_file("projects", n, s.token),
+    "PUT /ap/delete-project/{id}": lambda s, n: ("PUT", f"/ap/delete-project/{s.projects.pop()}", {}),
+}
+REPORT_SHARE = 0.05
+
+
+class Sample(random.Random):
+    # Live ids to spread requests over, read once from the generated data.
+    def __init__(self, database: str, seed: int):
+        super().__init__(seed)
+        connection = sqlite3.connect(database)
+        try:
+            self.projects = [row[0] for row in connection.execute(
+                "SELECT id FROM ap_projects WHERE is_deleted = 0 ORDER BY id")]
+            self.archived_projects = [row[0] for row in connection.execute(
+                "SELECT id FROM archived_ap_projects ORDER BY id")]
+            self.open_projects = [row[0] for row in connection.execute(
+                "SELECT id FROM ap_projects WHERE is_deleted = 0 AND balance >= 1 ORDER BY id")]
+            self.vendor_pos = connection.execute(
+                "SELECT id, project_id FROM po_to_vendor WHERE is_deleted = 0 AND balance >= 1 ORDER BY id").fetchall()
+            # Invoices with at least a unit left unpaid, since payments may not
+            # exceed the invoice amount.
+            unpaid = ("i.invoice_amount - (SELECT coalesce(sum(t.transaction_amount), 0) FROM transactions AS t "
+                      "WHERE t.invoice_id = i.id AND t.is_deleted = 0) >= 1")
+            self.invoices = connection.execute(
+                "SELECT i.id, i.project_id FROM invoices AS i JOIN po_to_vendor AS v ON v.id = i.vendor_po_id "
+                f"WHERE i.is_deleted = 0 AND v.is_deleted = 0 AND v.balance >= 1 AND {unpaid} ORDER BY i.id").fetchall()
+            self.vendor_invoices = {}
+            for vendor, invoice_id in connection.execute(
+                    "SELECT v.vendor, i.id FROM invoices AS i JOIN po_to_vendor AS v ON v.id = i.vendor_po_id "
+                    "JOIN ap_projects AS p ON p.id = i.project_id WHERE i.is_deleted = 0 AND v.is_deleted = 0 "
+                    f"AND p.is_deleted = 0 AND v.balance >= 1 AND p.balance >= 1 AND {unpaid} ORDER BY i.id"):
+                self.vendor_invoices.setdefault(vendor, []).append(invoice_id)
+            self.vendors = sorted(self.vendor_invoices)
+            self.clients = [row[0] for row in connection.execute("SELECT DISTINCT client FROM ap_projects")]
+            references = connection.execute(
+                "SELECT quotation, vendor_po FROM ap_projects AS p JOIN po_to_vendor AS v ON v.project_id = p.id "
+                "WHERE p.is_deleted = 0 ORDER BY p.id LIMIT 500").fetchall()
+        finally:
+            connection.close()
+        self.search_terms = [reference[:9] for row in references for reference in row] + ["Acme", "Globe Supply"]
+        self.token = f"{seed % 100:02d}"
+        self.replays = {}
+        self.shuffle(self.projects)
+
+
+def percentile(values: list, pct: int):
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1] * 1000 if len(values) > 1 else 0.0
+
+
+async def measure_route(client, sample: Sample, name: str, requests: int, concurrency: int):
+    build = ROUTES[name]
+    latencies, errors = [], 0
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request, errors
+        while next_request < requests:
+            n = next_request
+            next_request += 1
+            method, url, kwargs = build(sample, n)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+
+    # A separate, sequential pass so tracing doesn't skew the latencies above.
+    peak = 0
+    tracemalloc.start()
+    try:
+        for n in range(requests, requests + MEMORY_SAMPLES):
+            method, url, kwargs = build(sample, n)
+            tracemalloc.reset_peak()
+            await client.request(method, url, **kwargs)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    if errors == requests:
+        return {"requests": requests, "errors": errors, "p50_ms": None, "p95_ms": None, "p99_ms": None,
+                "throughput_rps": None, "peak_alloc_kib": peak / 1024}
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": requests / elapsed,
+        "peak_alloc_kib": peak / 1024,
+    }
+
+
+async def run(database: str, routes: list, requests: int, concurrency: int, seed: int):
+    import httpx
+    from database import async_engine
+    from main import app
+
+    sample = Sample(database, seed)
+    results = {}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in routes:
+                count = max(3, int(requests * REPORT_SHARE)) if "/reports/" in name else requests
+                results[name] = await measure_route(client, sample, name, count, concurrency)
+                if results[name]["p95_ms"] is None:
+                    print(f"{name:<42}{'all requests failed':>26}", file=sys.stderr)
+                else:
+                    print(f"{name:<42}{results[name]['p95_ms']:>10.2f} ms p95", file=sys.stderr)
+    finally:
+        await async_engine.dispose()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float):
+    regressions = {}
+    for name, metrics in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        # Any new failure is a regression, whatever the tolerance.
+        if metrics["errors"] > previous.get("errors", 0):
+            regressions.setdefault(name, []).append(f"errors {previous.get('errors', 0)} -> {metrics['errors']}")
+        for metric, direction in COMPARED_METRICS.items():
+            before, after = previous.get(metric), metrics[metric]
+            if not before or after is None:
+                continue
+            change = (after - before) / before * direction
+            # Sub-millisecond latencies are mostly noise, so small absolute changes never count.
+            if metric.endswith("_ms") and abs(after - before) < min_delta_ms:
+                continue
+            if change > tolerance:
+                regressions.setdefault(name, []).append(f"{metric} {before:.2f} -> {after:.2f}")
+    return regressions
+
+
+def print_results(results: dict, baseline: dict | None):
+    columns = ["requests", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_alloc_kib"]
+    print(f"{'route':<42}" + "".join(f"{column:>16}" for column in columns))
+    for name, metrics in results.items():
+        line = f"{name:<42}"
+        for column in columns:
+            value = "-" if metrics[column] is None else metrics[column]
+            line += f"{value:>16.2f}" if isinstance(value, float) else f"{value:>16}"
+        print(line)
+        previous = (baseline or {}).get(name)
+        if previous:
+            print(f"{'  baseline':<42}" + "".join(
+                f"{previous.get(column, 0):>16.2f}" if isinstance(previous.get(column), float)
+                else f"{'-' if previous.get(column) is None else previous[column]:>16}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=10000, help="size of the generated dataset")
+    parser.add_argument("--database", help="reuse a dataset made by benchmarks/datagen.py instead of generating one")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--route", action="append", choices=list(ROUTES), help="only run these routes")
+    parser.add_argument("--output", help="write the results to this JSON file, e.g. to use as a baseline")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change before flagging")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="latency changes below this never count")
+    args = parser.parse_args()
+    # Report exports on a large dataset trip the slow query log on every run.
+    logging.getLogger("apar.sql").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "suite.db")
+        os.environ["APAR_DATABASE_PATH"] = database
+
+        from database import engine
+        from migrations import migrate
+        from benchmarks.datagen import generate
+        from archive import archive_batch
+
+        if args.database:
+            shutil.copyfile(args.database, database)
+            migrate(engine)
+        else:
+            migrate(engine)
+            generate(engine, args.transactions, args.seed)
+        with engine.begin() as connection:
+            while archive_batch(connection, ARCHIVE_CUTOFF):
+                pass
+        with sqlite3.connect(database) as connection:
+            dataset = {table: connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                       for table in ("ap_projects", "po_to_vendor", "invoices", "transactions", "archived_ap_projects")}
+
+        started = time.perf_counter()
+        results = asyncio.run(run(database, args.route or list(ROUTES), args.requests, args.concurrency, args.seed))
+        engine.dispose()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            saved = json.load(file)
+        baseline = saved["routes"]
+        if saved["dataset"] != dataset:
+            print(f"warning: baseline dataset {saved['dataset']} differs from this run's {dataset}")
+
+    print_results(results, baseline)
+    print(f"\ndataset {dataset}, {time.perf_counter() - started:.1f}s, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "dataset": dataset,
+                "settings": {"requests": args.requests, "concurrency": args.concurrency, "seed": args.seed},
+                "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                                "machine": platform.machine()},
+                "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                "routes": results,
+            }, file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for name, changes in regressions.items():
+            print(f"REGRESSION {name}: {', '.join(changes)}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
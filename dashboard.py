@@ -0,0 +1,181 @@
+import argparse
+import os
+import zlib
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine
+from models import FxRate
+
+
+BASE_CURRENCY = os.environ.get('APAR_BASE_CURRENCY', 'PHP')
+AGING_BUCKETS = ['0-30', '31-60', '61-90', '90+']
+CASH_FLOW_MONTHS = 12
+NO_VENDOR = '(no vendor PO)'
+
+# The dashboard is cached like the project list, keyed on the project version
+# sequence, which moves on every write to any project, PO, invoice or
+# transaction, plus the archive's high-water mark (see archive.py). The rates
+# and the date are folded into the version too, so a rate change or a new day
+# (which shifts the aging buckets) renders afresh.
+DASHBOARD_VERSION_QUERY = text(
+    "SELECT (SELECT coalesce(max(version), 0) FROM ap_projects) AS version, "
+    "(SELECT coalesce(max(archive_id), 0) FROM archived_ap_projects) AS archived, "
+    "(SELECT group_concat(currency || '=' || rate, ',') FROM (SELECT currency, rate FROM fx_rates ORDER BY currency)) "
+    "AS rates"
+)
+
+# The whole book in one statement, grouped by SQLite down to one row per
+# (vendor, client, currency, bucket or month): outstanding invoice amounts by
+# age, open PO balances, and payments over the last CASH_FLOW_MONTHS months.
+# Python only folds these grouped rows, never individual records.
+DASHBOARD_QUERY = text(
+    "WITH paid_by_invoice AS ("
+    "SELECT invoice_id, sum(transaction_amount) AS paid FROM transactions WHERE is_deleted = 0 GROUP BY invoice_id"
+    "), open_invoices AS ("
+    "SELECT i.project_id, i.vendor_po_id, i.currency, i.invoice_amount - coalesce(pi.paid, 0) AS outstanding, "
+    "julianday(:today) - julianday(date(i.created_at)) AS age_days "
+    "FROM invoices AS i LEFT JOIN paid_by_invoice AS pi ON pi.invoice_id = i.id "
+    "WHERE i.is_deleted = 0 AND i.invoice_amount - coalesce(pi.paid, 0) > 0.005"
+    ") "
+    "SELECT 'outstanding' AS section, coalesce(v.vendor, :no_vendor) AS vendor, p.client, o.currency, "
+    "CASE WHEN o.age_days <= 30 THEN '0-30' WHEN o.age_days <= 60 THEN '31-60' "
+    "WHEN o.age_days <= 90 THEN '61-90' ELSE '90+' END AS period, sum(o.outstanding) AS amount "
+    "FROM open_invoices AS o JOIN ap_projects AS p ON p.id = o.project_id AND p.is_deleted = 0 "
+    "LEFT JOIN po_to_vendor AS v ON v.id = o.vendor_po_id "
+    "GROUP BY 2, 3, 4, 5 "
+    "UNION ALL "
+    "SELECT 'exposure', v.vendor, p.client, v.currency, NULL, sum(v.balance) "
+    "FROM po_to_vendor AS v JOIN ap_projects AS p ON p.id = v.project_id AND p.is_deleted = 0 "
+    "WHERE v.is_deleted = 0 AND v.balance > 0.005 "
+    "GROUP BY 2, 3, 4 "
+    "UNION ALL "
+    "SELECT 'paid', coalesce(v.vendor, :no_vendor), p.client, i.currency, substr(t.date_paid, 1, 7), "
+    "sum(t.transaction_amount) "
+    "FROM transactions AS t JOIN invoices AS i ON i.id = t.invoice_id "
+    "JOIN ap_projects AS p ON p.id = t.project_id AND p.is_deleted = 0 "
+    "LEFT JOIN po_to_vendor AS v ON v.id = t.vendor_po_id "
+    "WHERE t.is_deleted = 0 AND t.date_paid >= :cash_flow_start "
+    "GROUP BY 2, 3, 4, 5"
+)
+
+
+def cash_flow_months(today: date):
+    months = []
+    year, month = today.year, today.month
+    for _ in range(CASH_FLOW_MONTHS):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+
+def parse_rates(rates: str | None):
+    rates = dict(pair.split('=') for pair in rates.split(',')) if rates else {}
+    return {currency: float(rate) for currency, rate in rates.items()}
+
+
+async def dashboard_version(db: AsyncSession, today: date):
+    row = (await db.execute(DASHBOARD_VERSION_QUERY)).one()
+    checksum = zlib.crc32((row.rates or '').encode())
+    return f"{row.version}.{row.archived}-{checksum:08x}-{today.isoformat()}", parse_rates(row.rates)
+
+
+def empty_rollup():
+    return {"buckets": dict.fromkeys(AGING_BUCKETS, 0.0), "outstanding": 0.0, "exposure": 0.0}
+
+
+def summarize(rows, rates: dict, today: date):
+    months = cash_flow_months(today)
+    totals = empty_rollup()
+    by_vendor, by_client, by_currency = {}, {}, {}
+    cash_flow = dict.fromkeys(months, 0.0)
+    unconverted = set()
+
+    for section, vendor, client, currency, period, amount in rows:
+        native = by_currency.setdefault(currency, {"currency": currency, "rate": rates.get(currency),
+                                                   "outstanding": 0.0, "exposure": 0.0, "paid": 0.0})
+        native[section] += amount
+        if currency not in rates:
+            unconverted.add(currency)
+            continue
+
+        amount *= rates[currency]
+        if section == 'paid':
+            if period in cash_flow:
+                cash_flow[period] += amount
+            continue
+        for rollup in (totals, by_vendor.setdefault(vendor, empty_rollup()), by_client.setdefault(client, empty_rollup())):
+            rollup[section] += amount
+            if section == 'outstanding':
+                rollup["buckets"][period] += amount
+
+    def rounded(rollup: dict):
+        return {"buckets": {bucket: round(amount, 2) for bucket, amount in rollup["buckets"].items()},
+                "outstanding": round(rollup["outstanding"], 2), "exposure": round(rollup["exposure"], 2)}
+
+    def ranked(rollups: dict):
+        return [{"name": name, **rounded(rollup)}
+                for name, rollup in sorted(rollups.items(), key=lambda item: (-item[1]["exposure"], item[0]))]
+
+    return {
+        "as_of": today.isoformat(),
+        "base_currency": BASE_CURRENCY,
+        "aging_buckets": AGING_BUCKETS,
+        "totals": rounded(totals),
+        "by_currency": [
+            {**native, **{key: round(native[key], 2) for key in ("outstanding", "exposure", "paid")}}
+            for _, native in sorted(by_currency.items())
+        ],
+        "by_vendor": ranked(by_vendor),
+        "by_client": ranked(by_client),
+        "cash_flow": [{"month": month, "paid": round(paid, 2)} for month, paid in cash_flow.items()],
+        "unconverted_currencies": sorted(unconverted),
+    }
+
+
+async def build_dashboard(db: AsyncSession, rates: dict, today: date):
+    months = cash_flow_months(today)
+    rows = (await db.execute(DASHBOARD_QUERY, {
+        "today": today.isoformat(),
+        "no_vendor": NO_VENDOR,
+        "cash_flow_start": f"{months[0]}-01",
+    })).all()
+    return summarize(rows, rates, today)
+
+
+def set_rates(rates: list):
+    with engine.begin() as connection:
+        for currency, rate in rates:
+            statement = insert(FxRate).values(currency=currency.upper(), rate=float(rate))
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[FxRate.currency],
+                set_={"rate": statement.excluded.rate, "updated_at": func.now()},
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Show or set the FX rates the dashboard converts to {BASE_CURRENCY} with.")
+    parser.add_argument("--set-rate", nargs=2, action="append", metavar=("CURRENCY", "RATE"), default=[],
+                        help=f"units of {BASE_CURRENCY} per unit of CURRENCY")
+    args = parser.parse_args()
+
+    for currency, rate in args.set_rate:
+        try:
+            valid = Decimal(rate) > 0
+        except InvalidOperation:
+            valid = False
+        if not valid or len(currency) != 3:
+            parser.error(f"{currency} {rate}: expected a 3-letter currency code and a rate greater than 0")
+    set_rates(args.set_rate)
+
+    with engine.connect() as connection:
+        for currency, rate, updated_at in connection.execute(text(
+            "SELECT currency, rate, updated_at FROM fx_rates ORDER BY currency"
+        )):
+            print(f"{currency} {rate:>14.6f}  (updated {updated_at})")
+
+
+if __name__ == "__main__":
+    main()
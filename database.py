@@ -1,11 +1,55 @@
-from sqlalchemy import create_engine
+import os
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-SQL_ALCHEMY_DATABASE_URL = 'sqlite:///./apar.db'
+DATABASE_PATH = os.environ.get('APAR_DATABASE_PATH', './apar.db')
+BUSY_TIMEOUT_MS = 5000
+
+SQL_ALCHEMY_DATABASE_URL = f'sqlite:///{DATABASE_PATH}'
+ASYNC_SQL_ALCHEMY_DATABASE_URL = f'sqlite+aiosqlite:///{DATABASE_PATH}'
 
 engine = create_engine(SQL_ALCHEMY_DATABASE_URL, connect_args={
                        'check_same_thread': False})
 
+async_engine = create_async_engine(ASYNC_SQL_ALCHEMY_DATABASE_URL)
+
+
+# WAL lets page renders keep reading while a payment is being written, and the
+# busy timeout makes concurrent writers queue for the write lock instead of
+# failing straight away with "database is locked".
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# Collects the SQL statements run on an engine inside the block, so a page's
+# query count can be checked against its budget as the data behind it grows.
+@contextmanager
+def count_queries(bind=async_engine.sync_engine):
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", record_statement)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# Request handlers use the async session so queries run on aiosqlite's worker
+# thread instead of blocking the event loop. The sync engine is kept for schema
+# setup and for report exports, which already run in the threadpool.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
@@ -0,0 +1,133 @@
+import argparse
+import csv
+import os
+import sys
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine
+
+
+DUPLICATE_WINDOW_DAYS = int(os.environ.get('APAR_DUPLICATE_WINDOW_DAYS', 7))
+DUPLICATE_AMOUNT_TOLERANCE = Decimal(os.environ.get('APAR_DUPLICATE_AMOUNT_TOLERANCE', '0.01'))
+DUPLICATE_MATCH_LIMIT = 5
+
+# Reasons that are certainly the same payment; "similar" matches are only
+# likely duplicates and can be confirmed by the user.
+EXACT_DUPLICATE_REASONS = {'dv_reference', 'invoice'}
+
+# Each branch is an equality/range lookup on one of the composite indexes on
+# transactions, so a check costs a few index seeks however large the ledger is.
+# DV references are also looked up in archived_transactions: a DV paid before
+# its project was archived is still paid. The invoice and vendor PO branches
+# only need the hot table, since archived invoices and POs take no payments.
+# date_paid is stored as "YYYY-MM-DD HH:MM:SS.ffffff" text and compared against
+# "YYYY-MM-DD" day bounds.
+PAYMENT_DUPLICATES_QUERY = text(
+    "SELECT * FROM ("
+    "SELECT id, dv_reference, transaction_amount, date_paid, 'dv_reference' AS reason FROM transactions "
+    "WHERE dv_reference = :dv_reference AND is_deleted = 0 "
+    "UNION ALL "
+    "SELECT id, dv_reference, transaction_amount, date_paid, 'dv_reference' AS reason FROM archived_transactions "
+    "WHERE dv_reference = :dv_reference AND is_deleted = 0 "
+    "UNION ALL "
+    "SELECT id, dv_reference, transaction_amount, date_paid, 'invoice' AS reason FROM transactions "
+    "WHERE invoice_id = :invoice_id AND transaction_amount = :amount "
+    "AND date_paid >= :paid_on AND date_paid < :paid_next_day AND is_deleted = 0 "
+    "UNION ALL "
+    "SELECT id, dv_reference, transaction_amount, date_paid, 'similar' AS reason FROM transactions "
+    "WHERE vendor_po_id = :vendor_po_id AND date_paid >= :window_start AND date_paid < :window_end "
+    "AND abs(transaction_amount - :amount) <= :amount * :tolerance AND is_deleted = 0"
+    ") LIMIT :limit"
+)
+
+# Batch scan over the whole ledger: pairs that share a DV reference, hot or
+# archived, plus pairs on the same vendor PO with a similar amount paid within
+# the window (archived projects are settled, so those only matter among hot
+# payments). Each pair is reported once.
+LEDGER_DUPLICATES_QUERY = text(
+    "SELECT a.id AS transaction_id, b.id AS duplicate_id, b.project_id, b.vendor_po_id, "
+    "a.dv_reference, b.dv_reference AS duplicate_dv_reference, "
+    "a.transaction_amount, b.transaction_amount AS duplicate_amount, "
+    "a.date_paid, b.date_paid AS duplicate_date_paid, 'dv_reference' AS reason "
+    "FROM transactions AS a JOIN transactions AS b ON b.dv_reference = a.dv_reference AND b.id > a.id "
+    "WHERE a.is_deleted = 0 AND b.is_deleted = 0 "
+    "UNION ALL "
+    "SELECT a.id, b.id, b.project_id, b.vendor_po_id, a.dv_reference, b.dv_reference, "
+    "a.transaction_amount, b.transaction_amount, a.date_paid, b.date_paid, 'dv_reference' "
+    "FROM archived_transactions AS a JOIN transactions AS b ON b.dv_reference = a.dv_reference "
+    "WHERE a.is_deleted = 0 AND b.is_deleted = 0 "
+    "UNION ALL "
+    "SELECT a.id, b.id, b.project_id, b.vendor_po_id, a.dv_reference, b.dv_reference, "
+    "a.transaction_amount, b.transaction_amount, a.date_paid, b.date_paid, 'dv_reference' "
+    "FROM archived_transactions AS a JOIN archived_transactions AS b ON b.dv_reference = a.dv_reference AND b.id > a.id "
+    "WHERE a.is_deleted = 0 AND b.is_deleted = 0 "
+    "UNION ALL "
+    "SELECT a.id, b.id, b.project_id, b.vendor_po_id, a.dv_reference, b.dv_reference, "
+    "a.transaction_amount, b.transaction_amount, a.date_paid, b.date_paid, "
+    "CASE WHEN a.invoice_id = b.invoice_id AND a.transaction_amount = b.transaction_amount "
+    "AND date(a.date_paid) = date(b.date_paid) THEN 'invoice' ELSE 'similar' END "
+    "FROM transactions AS a JOIN transactions AS b ON b.vendor_po_id = a.vendor_po_id "
+    "AND b.date_paid >= a.date_paid AND b.date_paid < date(a.date_paid, :window_end_offset) "
+    "AND (b.date_paid > a.date_paid OR b.id > a.id) "
+    "WHERE a.is_deleted = 0 AND b.is_deleted = 0 "
+    "AND b.dv_reference IS NOT a.dv_reference "
+    "AND abs(b.transaction_amount - a.transaction_amount) <= a.transaction_amount * :tolerance"
+)
+
+
+async def find_payment_duplicates(db: AsyncSession, transaction_data: dict,
+                                  window_days: int = DUPLICATE_WINDOW_DAYS,
+                                  tolerance: Decimal = DUPLICATE_AMOUNT_TOLERANCE):
+    paid_on = transaction_data["date_paid"]
+    rows = (await db.execute(PAYMENT_DUPLICATES_QUERY, {
+        "dv_reference": transaction_data["dv_reference"],
+        "invoice_id": transaction_data["invoice_id"],
+        "vendor_po_id": transaction_data["vendor_po_id"],
+        "amount": float(transaction_data["transaction_amount"]),
+        "tolerance": float(tolerance),
+        "paid_on": paid_on.isoformat(),
+        "paid_next_day": (paid_on + timedelta(days=1)).isoformat(),
+        "window_start": (paid_on - timedelta(days=window_days)).isoformat(),
+        "window_end": (paid_on + timedelta(days=window_days + 1)).isoformat(),
+        "limit": DUPLICATE_MATCH_LIMIT,
+    })).mappings().all()
+
+    return [dict(row) for row in rows]
+
+
+def ledger_duplicates_query(window_days: int = DUPLICATE_WINDOW_DAYS,
+                            tolerance: Decimal = DUPLICATE_AMOUNT_TOLERANCE):
+    return LEDGER_DUPLICATES_QUERY.bindparams(window_end_offset=f"+{window_days + 1} days", tolerance=float(tolerance))
+
+
+def duplicate_payment_error(duplicates: list, confirm_duplicate: bool):
+    exact = [duplicate for duplicate in duplicates if duplicate["reason"] in EXACT_DUPLICATE_REASONS]
+    if exact:
+        return f"Duplicate payment: already recorded under DV {exact[0]['dv_reference']}"
+    if duplicates and not confirm_duplicate:
+        references = ", ".join(duplicate["dv_reference"] or "no DV" for duplicate in duplicates)
+        return f"Possible duplicate payment, similar to {references}. Confirm it is not a duplicate to record it"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan the transaction ledger for duplicate payments.")
+    parser.add_argument("--window-days", type=int, default=DUPLICATE_WINDOW_DAYS)
+    parser.add_argument("--tolerance", type=Decimal, default=DUPLICATE_AMOUNT_TOLERANCE,
+                        help="relative amount difference still treated as the same payment")
+    args = parser.parse_args()
+
+    writer = csv.writer(sys.stdout)
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            ledger_duplicates_query(args.window_days, args.tolerance)
+        )
+        writer.writerow(result.keys())
+        for rows in result.partitions(1000):
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
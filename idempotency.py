@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from starlette.datastructures import Headers
+from database import async_engine
+from models import IdempotencyKey
+
+
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('APAR_IDEMPOTENCY_CACHE_SIZE', 1024))
+IDEMPOTENCY_TTL = timedelta(seconds=int(os.environ.get('APAR_IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)))
+IDEMPOTENCY_MAX_ROWS = int(os.environ.get('APAR_IDEMPOTENCY_MAX_ROWS', 100000))
+MAX_KEY_LENGTH = 255
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+REPLAYED_HEADER = (b'idempotent-replayed', b'true')
+
+
+def utcnow():
+    # Stored naive, like SQLite's CURRENT_TIMESTAMP.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def request_fingerprint(scope: dict, body: bytes):
+    digest = hashlib.sha256(f"{scope['method']} {scope['path']}?{scope['query_string'].decode('latin-1')}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    # Successful responses to writes, keyed by the client's Idempotency-Key and
+    # kept as (fingerprint, status, headers, body, expires_at). Recent keys are
+    # answered from an LRU in memory; idempotency_keys keeps every key until it
+    # expires, so a retry after a restart or an LRU eviction is still replayed.
+    # Every max_rows // 100 writes, set() also deletes expired keys and the
+    # oldest keys beyond max_rows, so the table stays near max_rows however
+    # long the app runs.
+
+    def __init__(self, maxsize: int, ttl: timedelta, max_rows: int = IDEMPOTENCY_MAX_ROWS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_every = max(1, max_rows // 100)
+        self.writes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def _remember(self, key: str, entry: tuple):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    async def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[4] > utcnow():
+                    self.entries.move_to_end(key)
+                    return entry
+                del self.entries[key]
+
+        async with async_engine.connect() as connection:
+            row = (await connection.execute(
+                select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.headers,
+                       IdempotencyKey.body, IdempotencyKey.expires_at)
+                .where(IdempotencyKey.key == key).where(IdempotencyKey.expires_at > utcnow())
+            )).first()
+        if row is None:
+            return None
+
+        entry = (row.fingerprint, row.status_code, [tuple(header) for header in json.loads(row.headers)], row.body,
+                 row.expires_at)
+        self._remember(key, entry)
+        return entry
+
+    async def set(self, key: str, fingerprint: str, status_code: int, headers: list, body: bytes):
+        entry = (fingerprint, status_code, headers, body, utcnow() + self.ttl)
+        self._remember(key, entry)
+        with self.lock:
+            self.writes += 1
+            purge_due = self.writes >= self.purge_every
+            if purge_due:
+                self.writes = 0
+
+        statement = insert(IdempotencyKey).values(key=key, fingerprint=fingerprint, status_code=status_code,
+                                                  headers=json.dumps(headers), body=body, expires_at=entry[4])
+        async with async_engine.begin() as connection:
+            # An expired row for the same key is overwritten rather than purged first.
+            await connection.execute(statement.on_conflict_do_update(
+                index_elements=[IdempotencyKey.key],
+                set_={column: statement.excluded[column]
+                      for column in ('fingerprint', 'status_code', 'headers', 'body', 'expires_at')},
+            ))
+            if purge_due:
+                await self._delete_stale(connection)
+
+    async def _delete_stale(self, connection):
+        # Both deletes walk ix_idempotency_keys_expires_at. Keys share one TTL,
+        # so the oldest expires_at are the oldest keys.
+        expired = (await connection.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.expires_at <= utcnow())
+        )).rowcount
+        oldest_kept = (select(IdempotencyKey.expires_at).order_by(IdempotencyKey.expires_at.desc())
+                       .offset(self.max_rows - 1).limit(1).scalar_subquery())
+        return expired + (await connection.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.expires_at < oldest_kept)
+        )).rowcount
+
+    async def purge(self):
+        with self.lock:
+            self.entries.clear()
+        async with async_engine.begin() as connection:
+            return await self._delete_stale(connection)
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+
+async def send_json(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class IdempotencyMiddleware:
+    # A write sent with an Idempotency-Key header runs once. Retries with the
+    # same key and the same request get the stored response back without
+    # reaching the handler; a retry that arrives while the first attempt is
+    # still running waits for it. Only 2xx responses are stored, so a request
+    # that was refused can be corrected and resubmitted under the same key.
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        key = Headers(scope=scope).get('idempotency-key')
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body = b''.join(chunks)
+        fingerprint = request_fingerprint(scope, body)
+
+        while True:
+            entry = await self.store.get(key)
+            if entry is not None:
+                if entry[0] != fingerprint:
+                    await send_json(send, 422, "Idempotency-Key was already used for a different request")
+                    return
+                await send({'type': 'http.response.start', 'status': entry[1],
+                            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in entry[2]]
+                            + [REPLAYED_HEADER]})
+                await send({'type': 'http.response.body', 'body': entry[3]})
+                return
+
+            running = self.store.in_flight.get(key)
+            if running is None:
+                break
+            await running.wait()
+
+        done = self.store.in_flight[key] = asyncio.Event()
+        body_sent = False
+        response_start, response_body = None, []
+
+        async def replay_receive():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send_and_capture(message):
+            nonlocal response_start
+            if message['type'] == 'http.response.start':
+                response_start = message
+            elif message['type'] == 'http.response.body':
+                response_body.append(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, send_and_capture)
+            if response_start is not None and 200 <= response_start['status'] < 300:
+                headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                           for name, value in response_start.get('headers', [])]
+                await self.store.set(key, fingerprint, response_start['status'], headers, b''.join(response_body))
+        finally:
+            del self.store.in_flight[key]
+            done.set()
@@ -0,0 +1,434 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, func, select, tuple_, union
+from sqlalchemy.engine import Connection
+from database import engine
+from archive import ARCHIVE_TABLES
+from models import APProject, Invoice, Transaction, POToVendor, User
+
+
+ARCHIVED_TRANSACTIONS = ARCHIVE_TABLES['transactions']
+ARCHIVED_VENDOR_POS = ARCHIVE_TABLES['po_to_vendor']
+
+IMPORT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 10000
+
+IMPORT_COLUMNS = {
+    'projects': ['client', 'quotation', 'acceptance', 'currency', 'total_po_amount'],
+    'vendor_pos': ['quotation', 'vendor_po', 'vendor', 'po_amount'],
+    'invoices': ['vendor_po', 'invoice_type', 'invoice_number', 'invoice_amount'],
+    'transactions': ['vendor_po', 'invoice_number', 'transaction_amount', 'dv_reference', 'date_paid'],
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_amount(value: str, field: str):
+    try:
+        amount = Decimal(value)
+    except (InvalidOperation, TypeError):
+        raise RowError(f"{field} is not a number")
+    if not amount.is_finite() or amount <= 0:
+        raise RowError(f"{field} must be greater than 0")
+    return amount.quantize(Decimal("0.01"))
+
+
+def parse_date(value: str, field: str):
+    try:
+        return date.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise RowError(f"{field} must be a YYYY-MM-DD date")
+
+
+def stored_amount(amount: Decimal):
+    return float(amount)
+
+
+def stored_datetime(value: date):
+    # Same text layout SQLAlchemy's SQLite DateTime type writes.
+    return f"{value.isoformat()} 00:00:00.000000"
+
+
+def bulk_insert(connection: Connection, model, rows: list):
+    # Plain DBAPI executemany with one prepared statement; building SQLAlchemy
+    # parameters per row costs more than the insert itself at this volume.
+    columns = list(rows[0])
+    connection.exec_driver_sql(
+        f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(row.values()) for row in rows],
+    )
+
+
+def invoice_totals(connection: Connection, invoice_ids: set):
+    # Amount and live payments so far per invoice, for the same "never pay an
+    # invoice more than it is for" rule apply_payments enforces.
+    return {invoice.id: (Decimal(str(invoice.invoice_amount)), Decimal(str(invoice.paid))) for invoice in connection.execute(
+        select(Invoice.id, Invoice.invoice_amount, func.coalesce(func.sum(Transaction.transaction_amount), 0).label('paid'))
+        .outerjoin(Transaction, and_(Transaction.invoice_id == Invoice.id, Transaction.is_deleted == False))
+        .where(Invoice.id.in_(invoice_ids))
+        .group_by(Invoice.id)
+    )}
+
+
+def require(row: dict, *fields: str):
+    for field in fields:
+        if not (row.get(field) or '').strip():
+            raise RowError(f"{field} is required")
+    return [row[field].strip() for field in fields]
+
+
+class Importer:
+    # Validation mirrors the add_* endpoints, but lookups are done once per batch
+    # with IN queries and kept in dictionaries, and inserts/balance deltas are
+    # written with executemany and one commit per batch. Keeping each batch in
+    # its own short transaction stops a large import from holding the write
+    # lock for the whole run.
+
+    def __init__(self, connection: Connection, kind: str, user_id: int):
+        self.connection = connection
+        self.kind = kind
+        self.user_id = user_id
+        self.report = {"kind": kind, "rows": 0, "imported": 0, "error_count": 0, "errors": []}
+        self.projects = {}
+        self.project_balances = {}
+        self.vendor_pos = {}
+        self.invoices = {}
+        self.seen = set()
+
+    def add_error(self, line: int, message: str):
+        self.report["error_count"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"row": line, "error": message})
+
+    def run(self, reader: csv.DictReader):
+        missing = [column for column in IMPORT_COLUMNS[self.kind] if column not in (reader.fieldnames or [])]
+        if missing:
+            raise RowError(f"Missing columns: {', '.join(missing)}")
+
+        batch = []
+        # Line 1 is the header row.
+        for line, row in enumerate(reader, start=2):
+            batch.append((line, row))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+
+        return self.report
+
+    def import_batch(self, batch: list):
+        self.report["rows"] += len(batch)
+        getattr(self, f"import_{self.kind}")(batch)
+        self.connection.commit()
+
+    def load_projects(self, quotations: set):
+        missing = quotations - self.projects.keys()
+        if missing:
+            for project in self.connection.execute(
+                select(APProject.id, APProject.quotation, APProject.balance, APProject.currency)
+                .where(APProject.quotation.in_(missing)).where(APProject.is_deleted == False)
+            ):
+                self.projects[project.quotation] = {"id": project.id, "balance": project.balance, "currency": project.currency}
+
+    def load_vendor_pos(self, vendor_po_numbers: set):
+        missing = vendor_po_numbers - self.vendor_pos.keys()
+        if missing:
+            for vendor_po in self.connection.execute(
+                select(POToVendor.id, POToVendor.vendor_po, POToVendor.project_id, POToVendor.balance, POToVendor.currency)
+                .where(POToVendor.vendor_po.in_(missing)).where(POToVendor.is_deleted == False)
+            ):
+                self.vendor_pos[vendor_po.vendor_po] = {
+                    "id": vendor_po.id, "project_id": vendor_po.project_id,
+                    "balance": vendor_po.balance, "currency": vendor_po.currency,
+                }
+
+    def import_projects(self, batch: list):
+        quotations = {(row.get('quotation') or '').strip() for _, row in batch}
+        existing = set(self.connection.scalars(
+            select(APProject.quotation).where(APProject.quotation.in_(quotations)).where(APProject.is_deleted == False)
+        ))
+
+        rows = []
+        for line, row in batch:
+            try:
+                client, quotation, acceptance, currency, amount = require(row, *IMPORT_COLUMNS['projects'])
+                total_po_amount = parse_amount(amount, 'total_po_amount')
+                if quotation in existing or quotation in self.seen:
+                    raise RowError("Project already exists")
+            except RowError as error:
+                self.add_error(line, str(error))
+                continue
+
+            self.seen.add(quotation)
+            rows.append({
+                "client": client, "quotation": quotation, "acceptance": acceptance, "currency": currency.upper(),
+                "total_po_amount": stored_amount(total_po_amount), "total_paid": 0, "balance": stored_amount(total_po_amount),
+                "is_paid": 0, "is_deleted": 0,
+                "created_by_id": self.user_id, "modified_by_id": self.user_id,
+            })
+
+        if rows:
+            bulk_insert(self.connection, APProject, rows)
+        self.report["imported"] += len(rows)
+
+    def import_vendor_pos(self, batch: list):
+        self.load_projects({(row.get('quotation') or '').strip() for _, row in batch})
+        vendor_po_numbers = {(row.get('vendor_po') or '').strip() for _, row in batch}
+        # vendor_po is unique across deleted and archived rows too, so check against every row.
+        existing = set(self.connection.scalars(union(
+            select(POToVendor.vendor_po).where(POToVendor.vendor_po.in_(vendor_po_numbers)),
+            select(ARCHIVED_VENDOR_POS.c.vendor_po).where(ARCHIVED_VENDOR_POS.c.vendor_po.in_(vendor_po_numbers)),
+        )))
+
+        rows = []
+        for line, row in batch:
+            try:
+                quotation, vendor_po, vendor, amount = require(row, *IMPORT_COLUMNS['vendor_pos'])
+                po_amount = parse_amount(amount, 'po_amount')
+                project = self.projects.get(quotation)
+                if project is None:
+                    raise RowError(f"Project {quotation} not found")
+                if vendor_po in existing or vendor_po in self.seen:
+                    raise RowError("Vendor already exists")
+                if po_amount > project["balance"]:
+                    raise RowError("PO amount is more than the balance")
+            except RowError as error:
+                self.add_error(line, str(error))
+                continue
+
+            self.seen.add(vendor_po)
+            rows.append({
+                "project_id": project["id"], "vendor_po": vendor_po, "vendor": vendor, "po_amount": stored_amount(po_amount),
+                "balance": stored_amount(po_amount), "currency": project["currency"], "is_paid": 0, "is_deleted": 0,
+                "created_by_id": self.user_id, "modified_by_id": self.user_id,
+            })
+
+        if rows:
+            bulk_insert(self.connection, POToVendor, rows)
+        self.report["imported"] += len(rows)
+
+    def import_invoices(self, batch: list):
+        self.load_vendor_pos({(row.get('vendor_po') or '').strip() for _, row in batch})
+        keys = {
+            (self.vendor_pos[vendor_po]["id"], (row.get('invoice_number') or '').strip())
+            for _, row in batch
+            if (vendor_po := (row.get('vendor_po') or '').strip()) in self.vendor_pos
+        }
+        existing = set()
+        if keys:
+            existing = set(self.connection.execute(
+                select(Invoice.vendor_po_id, Invoice.invoice_number)
+                .where(tuple_(Invoice.vendor_po_id, Invoice.invoice_number).in_(keys))
+                .where(Invoice.is_deleted == False)
+            ).tuples())
+
+        rows = []
+        for line, row in batch:
+            try:
+                vendor_po_number, invoice_type, invoice_number, amount = require(row, *IMPORT_COLUMNS['invoices'])
+                invoice_amount = parse_amount(amount, 'invoice_amount')
+                vendor_po = self.vendor_pos.get(vendor_po_number)
+                if vendor_po is None:
+                    raise RowError(f"Vendor PO {vendor_po_number} not found")
+                key = (vendor_po["id"], invoice_number)
+                if key in existing or key in self.seen:
+                    raise RowError("Invoice already exists")
+                if invoice_amount > vendor_po["balance"]:
+                    raise RowError("Invoice amount is more than the balance")
+            except RowError as error:
+                self.add_error(line, str(error))
+                continue
+
+            self.seen.add(key)
+            rows.append({
+                "project_id": vendor_po["project_id"], "vendor_po_id": vendor_po["id"], "invoice_type": invoice_type,
+                "invoice_number": invoice_number, "invoice_amount": stored_amount(invoice_amount), "currency": vendor_po["currency"],
+                "is_paid": 0, "is_deleted": 0,
+                "created_by_id": self.user_id, "modified_by_id": self.user_id,
+            })
+
+        if rows:
+            bulk_insert(self.connection, Invoice, rows)
+        self.report["imported"] += len(rows)
+
+    def import_transactions(self, batch: list):
+        self.load_vendor_pos({(row.get('vendor_po') or '').strip() for _, row in batch})
+        keys = {
+            (self.vendor_pos[vendor_po]["id"], (row.get('invoice_number') or '').strip())
+            for _, row in batch
+            if (vendor_po := (row.get('vendor_po') or '').strip()) in self.vendor_pos
+        }
+        missing = keys - self.invoices.keys()
+        if missing:
+            for invoice in self.connection.execute(
+                select(Invoice.id, Invoice.vendor_po_id, Invoice.invoice_number)
+                .where(tuple_(Invoice.vendor_po_id, Invoice.invoice_number).in_(missing))
+                .where(Invoice.is_deleted == False)
+            ):
+                self.invoices[(invoice.vendor_po_id, invoice.invoice_number)] = invoice.id
+
+        # Balances are read fresh for every batch, since payments recorded
+        # through the app while the import runs change them.
+        vendor_pos = {
+            self.vendor_pos[vendor_po]["id"]: self.vendor_pos[vendor_po]
+            for _, row in batch
+            if (vendor_po := (row.get('vendor_po') or '').strip()) in self.vendor_pos
+        }
+        self.project_balances = {}
+        if vendor_pos:
+            for vendor_po in self.connection.execute(
+                select(POToVendor.id, POToVendor.balance).where(POToVendor.id.in_(vendor_pos))
+            ):
+                vendor_pos[vendor_po.id]["balance"] = vendor_po.balance
+            for project in self.connection.execute(
+                select(APProject.id, APProject.balance)
+                .where(APProject.id.in_({vendor_po["project_id"] for vendor_po in vendor_pos.values()}))
+                .where(APProject.is_deleted == False)
+            ):
+                self.project_balances[project.id] = project.balance
+
+        # DVs of archived projects are still paid.
+        dv_references = {(row.get('dv_reference') or '').strip() for _, row in batch}
+        existing = set(self.connection.scalars(union(
+            select(Transaction.dv_reference).where(Transaction.dv_reference.in_(dv_references))
+            .where(Transaction.is_deleted == False),
+            select(ARCHIVED_TRANSACTIONS.c.dv_reference).where(ARCHIVED_TRANSACTIONS.c.dv_reference.in_(dv_references))
+            .where(ARCHIVED_TRANSACTIONS.c.is_deleted == False),
+        )))
+
+        # Same exact-duplicate rule as the app: an invoice paid the same amount
+        # on the same day, whatever the DV reference.
+        invoice_ids = {self.invoices[key] for key in keys if key in self.invoices}
+        invoices = invoice_totals(self.connection, invoice_ids) if invoice_ids else {}
+        paid_on_day = set()
+        if invoice_ids:
+            paid_on_day = {
+                (payment.invoice_id, Decimal(str(payment.transaction_amount)).quantize(Decimal("0.01")), payment.paid_on)
+                for payment in self.connection.execute(
+                    select(Transaction.invoice_id, Transaction.transaction_amount,
+                           func.date(Transaction.date_paid).label('paid_on'))
+                    .where(Transaction.invoice_id.in_(invoice_ids)).where(Transaction.is_deleted == False)
+                )
+            }
+
+        rows = []
+        lines = []
+        seen = set()
+        po_deltas = {}
+        project_deltas = {}
+        invoice_deltas = {}
+        for line, row in batch:
+            try:
+                vendor_po_number, invoice_number, amount, dv_reference, paid_on = require(row, *IMPORT_COLUMNS['transactions'])
+                transaction_amount = parse_amount(amount, 'transaction_amount')
+                date_paid = parse_date(paid_on, 'date_paid')
+                if dv_reference in existing:
+                    raise RowError(f"Duplicate payment: already recorded under DV {dv_reference}")
+                if dv_reference in self.seen or dv_reference in seen:
+                    raise RowError(f"Duplicate payment: DV {dv_reference} is used twice in this file")
+                vendor_po = self.vendor_pos.get(vendor_po_number)
+                if vendor_po is None:
+                    raise RowError(f"Vendor PO {vendor_po_number} not found")
+                invoice_id = self.invoices.get((vendor_po["id"], invoice_number))
+                if invoice_id is None:
+                    raise RowError(f"Invoice {invoice_number} not found")
+                project_id = vendor_po["project_id"]
+                if project_id not in self.project_balances:
+                    raise RowError("Project not found")
+                if transaction_amount > vendor_po["balance"]:
+                    raise RowError("Transaction amount is more than the PO balance")
+                if transaction_amount > self.project_balances[project_id]:
+                    raise RowError("Transaction amount is more than the project balance")
+                payment = (invoice_id, transaction_amount, date_paid.isoformat())
+                if payment in paid_on_day:
+                    raise RowError(f"Duplicate payment: invoice {invoice_number} is already paid {transaction_amount} on {date_paid}")
+                invoice_amount, paid = invoices[invoice_id]
+                if transaction_amount > invoice_amount - paid - invoice_deltas.get(invoice_id, 0):
+                    raise RowError("Transaction amount is more than the unpaid invoice amount")
+            except RowError as error:
+                self.add_error(line, str(error))
+                continue
+
+            seen.add(dv_reference)
+            paid_on_day.add(payment)
+            invoice_deltas[invoice_id] = invoice_deltas.get(invoice_id, 0) + transaction_amount
+            vendor_po["balance"] -= transaction_amount
+            self.project_balances[project_id] -= transaction_amount
+            po_deltas[vendor_po["id"]] = po_deltas.get(vendor_po["id"], 0) + transaction_amount
+            project_deltas[project_id] = project_deltas.get(project_id, 0) + transaction_amount
+            lines.append(line)
+            rows.append({
+                "project_id": project_id, "invoice_id": invoice_id, "vendor_po_id": vendor_po["id"],
+                "transaction_amount": stored_amount(transaction_amount), "date_paid": stored_datetime(date_paid), "dv_reference": dv_reference,
+                "is_deleted": 0, "created_by_id": self.user_id,
+            })
+
+        if not rows:
+            return
+
+        # Guarded like apply_payments: if a balance dropped between the read
+        # above and these updates, none of the batch is written.
+        updated_pos = self.connection.exec_driver_sql(
+            f"UPDATE {POToVendor.__tablename__} SET balance = round(balance - ?, 2), "
+            "is_paid = round(balance - ?, 2) = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND balance >= ?",
+            [(stored_amount(delta), stored_amount(delta), po_id, stored_amount(delta)) for po_id, delta in po_deltas.items()],
+        ).rowcount
+        updated_projects = self.connection.exec_driver_sql(
+            f"UPDATE {APProject.__tablename__} SET balance = round(balance - ?, 2), "
+            "total_paid = round(coalesce(total_paid, 0) + ?, 2), is_paid = round(balance - ?, 2) = 0, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ? AND balance >= ?",
+            [(stored_amount(delta), stored_amount(delta), stored_amount(delta), project_id, stored_amount(delta))
+             for project_id, delta in project_deltas.items()],
+        ).rowcount
+        # The updates hold the write lock, so these totals are current.
+        overpaid = any(invoice_deltas[invoice_id] > amount - paid
+                       for invoice_id, (amount, paid) in invoice_totals(self.connection, set(invoice_deltas)).items())
+        if updated_pos != len(po_deltas) or updated_projects != len(project_deltas) or overpaid:
+            self.connection.rollback()
+            for line in lines:
+                self.add_error(line, "Balances changed during the import; this batch was not imported")
+            return
+
+        bulk_insert(self.connection, Transaction, rows)
+        self.seen.update(seen)
+        self.report["imported"] += len(rows)
+
+
+def import_csv(file, kind: str, user_id: int):
+    text_file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='') if not isinstance(file, io.TextIOBase) else file
+
+    with engine.connect() as connection:
+        if connection.scalar(select(User.id).where(User.id == user_id)) is None:
+            raise RowError(f"User {user_id} not found")
+        connection.commit()
+        return Importer(connection, kind, user_id).run(csv.DictReader(text_file))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import AP history from a CSV file.")
+    parser.add_argument("kind", choices=IMPORT_COLUMNS.keys())
+    parser.add_argument("path", help="CSV file with a header row")
+    parser.add_argument("--user-id", type=int, required=True, help="user recorded as creator of the imported rows")
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8-sig', newline='') as file:
+        try:
+            report = import_csv(file, args.kind, args.user_id)
+        except RowError as error:
+            sys.exit(str(error))
+
+    json.dump(report, sys.stdout, indent=2, default=str)
+    print()
+    sys.exit(1 if report["error_count"] else 0)
+
+
+if __name__ == "__main__":
+    main()
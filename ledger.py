@@ -0,0 +1,152 @@
+import argparse
+import csv
+import sys
+from time import perf_counter
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from database import engine
+
+
+# Balances are derived from the transaction ledger: a project or vendor PO has
+# paid the sum of its live transactions, and its balance is what is left of
+# its total_po_amount / po_amount. project_ledger and vendor_po_ledger hold
+# that sum per project and per PO, and the triggers below move it with every
+# transaction insert, update or delete, whichever code path wrote it.
+SNAPSHOTS = {
+    'project_ledger': 'project_id',
+    'vendor_po_ledger': 'vendor_po_id',
+}
+
+# Amounts are stored as REAL; anything under half a cent is rounding, not drift.
+DRIFT_TOLERANCE = 0.005
+
+
+def _snapshot_change(table: str, key_column: str, row: str, sign: str):
+    key = f"{row}.{key_column}"
+    return (f"INSERT INTO {table} ({key_column}, total_paid, payment_count) "
+            f"SELECT {key}, {sign}{row}.transaction_amount, {sign}1 WHERE {key} IS NOT NULL AND {row}.is_deleted = 0 "
+            f"ON CONFLICT ({key_column}) DO UPDATE SET "
+            f"total_paid = round(total_paid + excluded.total_paid, 2), "
+            f"payment_count = payment_count + excluded.payment_count;")
+
+
+def _ledger_trigger_statements():
+    add = ' '.join(_snapshot_change(table, key, 'new', '') for table, key in SNAPSHOTS.items())
+    remove = ' '.join(_snapshot_change(table, key, 'old', '-') for table, key in SNAPSHOTS.items())
+
+    yield f"CREATE TRIGGER IF NOT EXISTS ledger_transactions_ai AFTER INSERT ON transactions BEGIN {add} END"
+    # Balance-only updates elsewhere never touch these columns, so the trigger
+    # only fires when a payment is edited, moved or soft-deleted.
+    yield (f"CREATE TRIGGER IF NOT EXISTS ledger_transactions_au AFTER UPDATE OF "
+           f"project_id, vendor_po_id, transaction_amount, is_deleted ON transactions BEGIN {remove} {add} END")
+    yield f"CREATE TRIGGER IF NOT EXISTS ledger_transactions_ad AFTER DELETE ON transactions BEGIN {remove} END"
+
+
+def create_ledger_triggers(engine: Engine):
+    with engine.begin() as connection:
+        for statement in _ledger_trigger_statements():
+            connection.execute(text(statement))
+
+
+def rebuild_snapshots(connection: Connection):
+    for table, key_column in SNAPSHOTS.items():
+        connection.execute(text(f"DELETE FROM {table}"))
+        connection.execute(text(
+            f"INSERT INTO {table} ({key_column}, total_paid, payment_count) "
+            f"SELECT {key_column}, round(sum(transaction_amount), 2), count(*) FROM transactions "
+            f"WHERE is_deleted = 0 AND {key_column} IS NOT NULL GROUP BY {key_column}"
+        ))
+
+
+# One pass over transactions, grouped by (project_id, vendor_po_id) and then
+# rolled up both ways, checked against the running totals on the project and
+# PO rows and against the trigger-kept snapshots. Only rows that disagree are
+# returned.
+RECONCILIATION_QUERY = text(
+    "WITH ledger AS MATERIALIZED ("
+    "SELECT project_id, vendor_po_id, sum(transaction_amount) AS paid, count(*) AS payments "
+    "FROM transactions WHERE is_deleted = 0 GROUP BY project_id, vendor_po_id"
+    "), project_totals AS ("
+    "SELECT project_id, round(sum(paid), 2) AS paid, sum(payments) AS payments FROM ledger GROUP BY project_id"
+    "), vendor_po_totals AS ("
+    "SELECT vendor_po_id, round(sum(paid), 2) AS paid, sum(payments) AS payments FROM ledger "
+    "WHERE vendor_po_id IS NOT NULL GROUP BY vendor_po_id"
+    ") "
+    "SELECT 'project' AS kind, p.id, p.quotation AS reference, "
+    "p.total_paid AS stored_paid, p.balance AS stored_balance, "
+    "s.total_paid AS snapshot_paid, s.payment_count AS snapshot_payments, "
+    "coalesce(t.paid, 0) AS ledger_paid, coalesce(t.payments, 0) AS ledger_payments, "
+    "round(p.total_po_amount - coalesce(t.paid, 0), 2) AS ledger_balance "
+    "FROM ap_projects AS p "
+    "LEFT JOIN project_totals AS t ON t.project_id = p.id "
+    "LEFT JOIN project_ledger AS s ON s.project_id = p.id "
+    "WHERE abs(coalesce(p.total_paid, 0) - coalesce(t.paid, 0)) > :tolerance "
+    "OR abs(p.balance - (p.total_po_amount - coalesce(t.paid, 0))) > :tolerance "
+    "OR abs(coalesce(s.total_paid, 0) - coalesce(t.paid, 0)) > :tolerance "
+    "OR coalesce(s.payment_count, 0) != coalesce(t.payments, 0) "
+    "UNION ALL "
+    "SELECT 'vendor_po', v.id, v.vendor_po, NULL, v.balance, s.total_paid, s.payment_count, "
+    "coalesce(t.paid, 0), coalesce(t.payments, 0), round(v.po_amount - coalesce(t.paid, 0), 2) "
+    "FROM po_to_vendor AS v "
+    "LEFT JOIN vendor_po_totals AS t ON t.vendor_po_id = v.id "
+    "LEFT JOIN vendor_po_ledger AS s ON s.vendor_po_id = v.id "
+    "WHERE abs(v.balance - (v.po_amount - coalesce(t.paid, 0))) > :tolerance "
+    "OR abs(coalesce(s.total_paid, 0) - coalesce(t.paid, 0)) > :tolerance "
+    "OR coalesce(s.payment_count, 0) != coalesce(t.payments, 0)"
+).bindparams(tolerance=DRIFT_TOLERANCE)
+
+
+def find_drift(connection: Connection):
+    return connection.execution_options(stream_results=True).execute(RECONCILIATION_QUERY)
+
+
+def repair_drift(connection: Connection):
+    # Snapshots are rebuilt from the ledger, then only the project and PO rows
+    # that disagree with them are rewritten, so the version triggers bump just
+    # the pages whose numbers actually change.
+    rebuild_snapshots(connection)
+    projects = connection.execute(text(
+        "UPDATE ap_projects SET total_paid = ledger.paid, balance = round(total_po_amount - ledger.paid, 2), "
+        "is_paid = round(total_po_amount - ledger.paid, 2) = 0, updated_at = CURRENT_TIMESTAMP "
+        "FROM (SELECT p.id, coalesce(s.total_paid, 0) AS paid FROM ap_projects AS p "
+        "LEFT JOIN project_ledger AS s ON s.project_id = p.id) AS ledger "
+        "WHERE ledger.id = ap_projects.id AND (abs(coalesce(ap_projects.total_paid, 0) - ledger.paid) > :tolerance "
+        "OR abs(ap_projects.balance - (ap_projects.total_po_amount - ledger.paid)) > :tolerance)"
+    ), {"tolerance": DRIFT_TOLERANCE}).rowcount
+    vendor_pos = connection.execute(text(
+        "UPDATE po_to_vendor SET balance = round(po_amount - ledger.paid, 2), "
+        "is_paid = round(po_amount - ledger.paid, 2) = 0, updated_at = CURRENT_TIMESTAMP "
+        "FROM (SELECT v.id, coalesce(s.total_paid, 0) AS paid FROM po_to_vendor AS v "
+        "LEFT JOIN vendor_po_ledger AS s ON s.vendor_po_id = v.id) AS ledger "
+        "WHERE ledger.id = po_to_vendor.id AND abs(po_to_vendor.balance - (po_to_vendor.po_amount - ledger.paid)) > :tolerance"
+    ), {"tolerance": DRIFT_TOLERANCE}).rowcount
+    return projects, vendor_pos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile project and vendor PO balances against the transaction ledger.")
+    parser.add_argument("--fix", action="store_true",
+                        help="rebuild the snapshots and rewrite drifted balances from the ledger")
+    args = parser.parse_args()
+
+    started = perf_counter()
+    writer = csv.writer(sys.stdout)
+    drifted = 0
+    with engine.connect() as connection:
+        result = find_drift(connection)
+        writer.writerow(result.keys())
+        for rows in result.partitions(1000):
+            writer.writerows(rows)
+            drifted += len(rows)
+    print(f"{drifted} drifted balances found in {perf_counter() - started:.2f}s", file=sys.stderr)
+
+    if args.fix and drifted:
+        with engine.begin() as connection:
+            projects, vendor_pos = repair_drift(connection)
+        print(f"rewrote {projects} project and {vendor_pos} vendor PO balances", file=sys.stderr)
+    elif drifted:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,30 @@
-from fastapi import FastAPI, Request, status
-from database import Base, engine
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, status
+from database import engine, async_engine
+from migrations import migrate
+from metrics import MetricsMiddleware
+from idempotency import IdempotencyMiddleware, idempotency_store
 from routers import accounts_payable
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from templating import precompile_templates
 from fastapi.responses import RedirectResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    migrate(engine)
+    await idempotency_store.purge()
+    yield
+    # aiosqlite keeps a worker thread per pooled connection; close them on shutdown.
+    await async_engine.dispose()
 
-Base.metadata.create_all(bind=engine)
 
-templates = Jinja2Templates(directory="./templates")
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+precompile_templates()
 
 app.mount("/static", StaticFiles(directory="./static"), name="static")
 
@@ -22,4 +36,8 @@ def render_projects(request: Request):
 async def health_check():
     return {'status': 'healthy'}
 
+@app.get("/metrics")
+async def export_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 app.include_router(accounts_payable.router)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import logging
+import os
+from contextvars import ContextVar
+from time import perf_counter
+from jinja2 import Template
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from database import engine, async_engine
+
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('APAR_SLOW_QUERY_MS', 100))
+UNMATCHED_ROUTE = 'unmatched'
+BACKGROUND_ROUTE = 'background'
+
+logger = logging.getLogger('apar.sql')
+
+REQUEST_DURATION = Histogram(
+    'apar_request_duration_seconds', 'Time spent handling a request, including streaming the body.',
+    ['method', 'route'],
+)
+REQUESTS = Counter('apar_requests_total', 'Requests handled, by response status.', ['method', 'route', 'status'])
+REQUESTS_IN_PROGRESS = Gauge('apar_requests_in_progress', 'Requests currently being handled.', ['method'])
+QUERY_DURATION = Histogram(
+    'apar_db_query_duration_seconds', 'Time spent executing each SQL statement.',
+    ['route', 'operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf')),
+)
+SLOW_QUERIES = Counter('apar_db_slow_queries_total', 'SQL statements slower than the slow query threshold.', ['route'])
+TEMPLATE_RENDER_DURATION = Histogram(
+    'apar_template_render_duration_seconds', 'Time spent rendering a Jinja template.',
+    ['template'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf')),
+)
+
+# The ASGI scope of the request being handled, so SQL timings can be labelled
+# with the route that issued them. Starlette adds the matched route to the
+# scope once routing is done, which is before any handler touches the database.
+current_scope: ContextVar[dict | None] = ContextVar('current_scope', default=None)
+
+
+def route_label(scope: dict | None):
+    if scope is None:
+        return BACKGROUND_ROUTE
+    route = scope.get('route')
+    return route.path if route is not None else UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        token = current_scope.set(scope)
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_label(scope)
+            REQUEST_DURATION.labels(method, route).observe(perf_counter() - started)
+            REQUESTS.labels(method, route, status_code).inc()
+            REQUESTS_IN_PROGRESS.labels(method).dec()
+            current_scope.reset(token)
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        started = perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER_DURATION.labels(self.name).observe(perf_counter() - started)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+@event.listens_for(async_engine.sync_engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - conn.info['query_started'].pop()
+    route = route_label(current_scope.get())
+    operation = statement.lstrip().split(None, 1)[0].upper()
+    QUERY_DURATION.labels(route, operation).observe(duration)
+
+    if duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        SLOW_QUERIES.labels(route).inc()
+        logger.warning("Slow query (%.1f ms) on %s: %s", duration * 1000, route, statement)
+
+
+@event.listens_for(engine, 'handle_error')
+@event.listens_for(async_engine.sync_engine, 'handle_error')
+def discard_query_timer(exception_context):
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
@@ -0,0 +1,202 @@
+import argparse
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.engine import Connection, Engine
+from database import Base, engine
+from archive import ARCHIVE_TABLES, HOT_TABLES
+from ledger import create_ledger_triggers, rebuild_snapshots
+from dashboard import BASE_CURRENCY
+from models import FxRate, IdempotencyKey, ProjectLedger, VendorPOLedger
+from page_cache import create_version_triggers
+from search import create_search_index
+
+
+# Schema changes are applied in order and the number applied so far is kept in
+# SQLite's PRAGMA user_version, so each one runs exactly once per database.
+# Append new steps; never edit or reorder ones that have shipped. Databases
+# created before this layer start at 0 and step 1 only adds missing tables.
+
+
+def create_tables(connection: Connection):
+    Base.metadata.create_all(connection)
+
+
+def add_project_version(connection: Connection):
+    columns = {row.name for row in connection.execute(text("PRAGMA table_info(ap_projects)"))}
+    if 'version' not in columns:
+        connection.execute(text("ALTER TABLE ap_projects ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        connection.execute(text("UPDATE ap_projects SET version = id"))
+
+
+def create_ledger_snapshots(connection: Connection):
+    Base.metadata.create_all(connection, tables=[ProjectLedger.__table__, VendorPOLedger.__table__])
+    rebuild_snapshots(connection)
+
+
+def create_fx_rates(connection: Connection):
+    Base.metadata.create_all(connection, tables=[FxRate.__table__])
+    connection.execute(text("INSERT OR IGNORE INTO fx_rates (currency, rate) VALUES (:currency, 1)"),
+                       {"currency": BASE_CURRENCY})
+
+
+def create_idempotency_keys(connection: Connection):
+    Base.metadata.create_all(connection, tables=[IdempotencyKey.__table__])
+
+
+def create_archive_tables(connection: Connection):
+    Base.metadata.create_all(connection, tables=list(ARCHIVE_TABLES.values()))
+
+
+def use_autoincrement_ids(connection: Connection):
+    # Archived rows keep their ids, so the hot tables must never hand an id out
+    # again once the archive job has deleted the rows holding the highest ones.
+    # Only AUTOINCREMENT tables guarantee that, and SQLite can only add it by
+    # rebuilding the table. The triggers on these tables are dropped first and
+    # recreated by create_triggers() once the migrations have run.
+    names = [table.name for table in HOT_TABLES]
+    triggers = connection.exec_driver_sql(
+        f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ({', '.join('?' * len(names))})",
+        tuple(names),
+    ).scalars().all()
+    for trigger in triggers:
+        connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+
+    for table in HOT_TABLES:
+        sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table.name,)).scalar()
+        if 'AUTOINCREMENT' not in sql.upper():
+            columns = ', '.join(column.name for column in table.columns)
+            create = str(CreateTable(table).compile(connection)).replace(
+                f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_rebuild ", 1)
+            connection.exec_driver_sql(create)
+            connection.exec_driver_sql(
+                f"INSERT INTO {table.name}_rebuild ({columns}) SELECT {columns} FROM {table.name}")
+            copied, original = connection.exec_driver_sql(
+                f"SELECT (SELECT count(*) FROM {table.name}_rebuild), (SELECT count(*) FROM {table.name})").one()
+            if copied != original:
+                raise RuntimeError(f"Rebuilding {table.name} copied {copied} of {original} rows")
+            connection.exec_driver_sql(f"DROP TABLE {table.name}")
+            connection.exec_driver_sql(f"ALTER TABLE {table.name}_rebuild RENAME TO {table.name}")
+            for index in table.indexes:
+                index.create(connection)
+
+        # Start past every id already handed out, archived rows included.
+        connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+        connection.exec_driver_sql(
+            f"INSERT INTO sqlite_sequence (name, seq) VALUES (?, max("
+            f"(SELECT coalesce(max(id), 0) FROM {table.name}), "
+            f"(SELECT coalesce(max(id), 0) FROM {ARCHIVE_TABLES[table.name].name})))",
+            (table.name,),
+        )
+
+
+def create_indexes(*names: str):
+    def migration(connection: Connection):
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(connection, checkfirst=True)
+    return migration
+
+
+def drop_indexes(*names: str):
+    def migration(connection: Connection):
+        for name in names:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return migration
+
+
+MIGRATIONS = [
+    ("create tables", [create_tables]),
+    ("add ap_projects.version", [add_project_version]),
+    ("lookup indexes for duplicate checks and page versions", [
+        create_indexes('ix_ap_projects_version', 'ix_transactions_dv_reference',
+                       'ix_transactions_invoice_id_amount', 'ix_transactions_vendor_po_id_date_paid'),
+    ]),
+    # Every page and write path filters on is_deleted = 0 plus a foreign key, so
+    # these indexes only hold live rows and are matched by SQLite's partial
+    # index rules against the literal "is_deleted = 0" SQLAlchemy renders.
+    ("partial indexes on live rows", [
+        create_indexes('ix_ap_projects_live_created_at_id', 'ix_po_to_vendor_live_project_id',
+                       'ix_invoices_live_project_id', 'ix_invoices_live_vendor_po_id_number',
+                       'ix_transactions_live_project_id_date_paid'),
+        drop_indexes('ix_ap_projects_created_at_id'),
+    ]),
+    ("ledger snapshots per project and vendor PO", [create_ledger_snapshots]),
+    ("fx rates for the dashboard", [create_fx_rates]),
+    ("vendor lookup for payment runs", [create_indexes('ix_po_to_vendor_live_vendor')]),
+    ("idempotency keys for replayed writes", [create_idempotency_keys]),
+    # The archive job deletes children by project_id whether or not they are
+    # soft-deleted, which the partial live-row indexes cannot serve.
+    ("archive tables for settled and deleted projects", [
+        create_archive_tables,
+        create_indexes('ix_ap_projects_settled_updated_at', 'ix_po_to_vendor_project_id',
+                       'ix_invoices_project_id', 'ix_transactions_project_id'),
+    ]),
+    ("autoincrement ids so archived ids are never reused", [use_autoincrement_ids]),
+    ("lookups on archived DV references and vendor PO numbers", [
+        create_indexes('ix_archived_transactions_dv_reference', 'ix_archived_po_to_vendor_vendor_po'),
+    ]),
+]
+
+
+def schema_version(connection: Connection):
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+@contextmanager
+def migration_transaction(engine: Engine):
+    # pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so DDL such
+    # as a table rebuild would otherwise run in autocommit and survive a failed
+    # step. With its implicit BEGIN turned off, an explicit one makes each
+    # migration, PRAGMA user_version included, commit or roll back as a whole.
+    with engine.connect() as connection:
+        driver_connection = connection.connection.driver_connection
+        isolation_level = driver_connection.isolation_level
+        driver_connection.isolation_level = None
+        try:
+            with connection.begin():
+                connection.exec_driver_sql("BEGIN")
+                yield connection
+        finally:
+            driver_connection.isolation_level = isolation_level
+
+
+def migrate(engine: Engine):
+    applied = []
+    for version, (description, steps) in enumerate(MIGRATIONS, start=1):
+        with migration_transaction(engine) as connection:
+            if schema_version(connection) >= version:
+                continue
+            for step in steps:
+                step(connection)
+            connection.execute(text(f"PRAGMA user_version = {version}"))
+        applied.append(f"{version}: {description}")
+
+    create_triggers(engine)
+    return applied
+
+
+def create_triggers(engine: Engine):
+    # Recreated with IF NOT EXISTS on every start, and after bulk loads that
+    # drop them.
+    create_version_triggers(engine)
+    create_search_index(engine)
+    create_ledger_triggers(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations to the AP database.")
+    parser.add_argument("--status", action="store_true", help="only print the current schema version")
+    args = parser.parse_args()
+
+    if not args.status:
+        for line in migrate(engine):
+            print(f"applied {line}")
+    with engine.connect() as connection:
+        print(f"schema version {schema_version(connection)} of {len(MIGRATIONS)}")
+
+
+if __name__ == "__main__":
+    main()
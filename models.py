@@ -1,5 +1,5 @@
 from database import Base
-from sqlalchemy import Integer, String, Boolean, Numeric, DateTime, ForeignKey
+from sqlalchemy import Integer, String, Text, LargeBinary, Boolean, Numeric, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -13,10 +13,16 @@ class BaseModel(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     is_deleted: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
-    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
 class APProject(BaseModel):
     __tablename__  = 'ap_projects'
+    __table_args__ = (
+        Index('ix_ap_projects_live_created_at_id', 'created_at', 'id', sqlite_where=text('is_deleted = 0')),
+        Index('ix_ap_projects_version', 'version'),
+        Index('ix_ap_projects_settled_updated_at', 'updated_at', sqlite_where=text('is_deleted = 1 OR is_paid = 1')),
+        {'sqlite_autoincrement': True},
+    )
 
     created_by_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
     modified_by_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
@@ -29,6 +35,7 @@ class APProject(BaseModel):
     total_paid: Mapped[float] = mapped_column(Numeric(10, 2), nullable=True)
     balance: Mapped[float] = mapped_column(Numeric(10, 2))
     is_paid: Mapped[bool] = mapped_column(Boolean, default=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
 
     invoices: Mapped[list['Invoice']] = relationship(back_populates="project")
     transaction: Mapped[list['Transaction']] = relationship(back_populates="project", order_by=lambda: Transaction.date_paid)
@@ -38,6 +45,13 @@ class APProject(BaseModel):
 
 class POToVendor(BaseModel):
     __tablename__ = 'po_to_vendor'
+    __table_args__ = (
+        Index('ix_po_to_vendor_live_project_id', 'project_id', sqlite_where=text('is_deleted = 0')),
+        Index('ix_po_to_vendor_live_vendor', 'vendor', sqlite_where=text('is_deleted = 0')),
+        Index('ix_po_to_vendor_project_id', 'project_id'),
+        {'sqlite_autoincrement': True},
+    )
+
     project_id: Mapped[int] = mapped_column(ForeignKey('ap_projects.id'), nullable=False)
     created_by_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
     modified_by_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
@@ -50,13 +64,20 @@ class POToVendor(BaseModel):
     is_paid: Mapped[bool] = mapped_column(Boolean, default=False)
 
     project: Mapped['APProject'] = relationship(back_populates="vendor_po")
-    invoices: Mapped['Invoice'] = relationship(back_populates="vendor_po")
+    invoices: Mapped[list['Invoice']] = relationship(back_populates="vendor_po")
     transaction: Mapped[list['Transaction']] = relationship(back_populates="vendor_po")
     creator: Mapped['User'] = relationship("User", foreign_keys=[created_by_id])
     modifier: Mapped['User'] = relationship("User", foreign_keys=[modified_by_id])
 
 class Invoice(BaseModel):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        Index('ix_invoices_live_project_id', 'project_id', sqlite_where=text('is_deleted = 0')),
+        Index('ix_invoices_live_vendor_po_id_number', 'vendor_po_id', 'invoice_number', sqlite_where=text('is_deleted = 0')),
+        Index('ix_invoices_project_id', 'project_id'),
+        {'sqlite_autoincrement': True},
+    )
+
     project_id: Mapped[int] = mapped_column(ForeignKey('ap_projects.id'), nullable=False)
     vendor_po_id: Mapped[int] = mapped_column(ForeignKey('po_to_vendor.id'), nullable=True)
     created_by_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
@@ -76,6 +97,14 @@ class Invoice(BaseModel):
 
 class Transaction(BaseModel):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_dv_reference', 'dv_reference'),
+        Index('ix_transactions_invoice_id_amount', 'invoice_id', 'transaction_amount'),
+        Index('ix_transactions_vendor_po_id_date_paid', 'vendor_po_id', 'date_paid'),
+        Index('ix_transactions_live_project_id_date_paid', 'project_id', 'date_paid', sqlite_where=text('is_deleted = 0')),
+        Index('ix_transactions_project_id', 'project_id'),
+        {'sqlite_autoincrement': True},
+    )
 
     project_id: Mapped[int] = mapped_column(ForeignKey('ap_projects.id'), nullable=False)
     invoice_id: Mapped[int] = mapped_column(ForeignKey('invoices.id'), nullable=False)
@@ -91,6 +120,43 @@ class Transaction(BaseModel):
     vendor_po: Mapped['POToVendor'] = relationship(back_populates="transaction")
     creator: Mapped['User'] = relationship("User", foreign_keys=[created_by_id])
 
+# Running totals of the live transactions per project and per vendor PO, kept
+# by triggers on transactions (see ledger.py). The balance columns above are
+# what writes check against; these are what they are reconciled with.
+class ProjectLedger(Base):
+    __tablename__ = 'project_ledger'
+    project_id: Mapped[int] = mapped_column(ForeignKey('ap_projects.id'), primary_key=True)
+    total_paid: Mapped[float] = mapped_column(Numeric(10, 2), nullable=False, default=0)
+    payment_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class VendorPOLedger(Base):
+    __tablename__ = 'vendor_po_ledger'
+    vendor_po_id: Mapped[int] = mapped_column(ForeignKey('po_to_vendor.id'), primary_key=True)
+    total_paid: Mapped[float] = mapped_column(Numeric(10, 2), nullable=False, default=0)
+    payment_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+# Units of the base currency (APAR_BASE_CURRENCY) per unit of each currency,
+# maintained locally with `python dashboard.py --set-rate` rather than fetched.
+class FxRate(Base):
+    __tablename__ = 'fx_rates'
+    currency: Mapped[str] = mapped_column(String(3), primary_key=True)
+    rate: Mapped[float] = mapped_column(Numeric(12, 6), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+# Responses to write requests sent with an Idempotency-Key header, replayed to
+# retries of the same request until they expire (see idempotency.py).
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    status_code: Mapped[int] = mapped_column(Integer, nullable=False)
+    headers: Mapped[str] = mapped_column(Text, nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
 
 class User(BaseModel):
     __tablename__ = 'users'
@@ -0,0 +1,145 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import APProject
+from archive import ARCHIVED_PROJECTS
+from templating import templates_version
+
+
+PAGE_CACHE_SIZE = int(os.environ.get('APAR_PAGE_CACHE_SIZE', 256))
+
+# ap_projects.version is drawn from one increasing sequence (max + 1), so a
+# project's version changes whenever it or its POs, invoices or transactions
+# do, and max(version) changes whenever anything in the project list does.
+# Triggers keep it current for every writer, including the bulk importer.
+NEXT_VERSION = "(SELECT coalesce(max(version), 0) + 1 FROM ap_projects)"
+
+CHILD_TABLES = ['po_to_vendor', 'invoices', 'transactions']
+
+
+def _version_trigger_statements():
+    bump_project = (f"UPDATE ap_projects SET version = {NEXT_VERSION}, updated_at = CURRENT_TIMESTAMP "
+                    f"WHERE id = new.id;")
+    yield (f"CREATE TRIGGER IF NOT EXISTS version_ap_projects_ai AFTER INSERT ON ap_projects "
+           f"BEGIN {bump_project} END")
+    yield (f"CREATE TRIGGER IF NOT EXISTS version_ap_projects_au AFTER UPDATE OF client, quotation, acceptance, "
+           f"currency, total_po_amount, total_paid, balance, is_paid, is_deleted ON ap_projects "
+           f"BEGIN {bump_project} END")
+
+    for table in CHILD_TABLES:
+        bump_parent = (f"UPDATE ap_projects SET version = {NEXT_VERSION}, updated_at = CURRENT_TIMESTAMP "
+                       f"WHERE id = new.project_id;")
+        yield (f"CREATE TRIGGER IF NOT EXISTS version_{table}_ai AFTER INSERT ON {table} "
+               f"BEGIN {bump_parent} END")
+        yield (f"CREATE TRIGGER IF NOT EXISTS version_{table}_au AFTER UPDATE ON {table} "
+               f"BEGIN {bump_parent} END")
+
+
+def create_version_triggers(engine: Engine):
+    with engine.begin() as connection:
+        for statement in _version_trigger_statements():
+            connection.execute(text(statement))
+
+
+class PageCache:
+    # Rendered pages keyed by (project_id, url, version). A write changes the
+    # version, so stale entries can never be served; invalidate() just frees
+    # them early instead of waiting for them to fall off the LRU end.
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key: tuple, body: bytes):
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, project_id: int | None = None):
+        # The project list shows every project, so any write also drops it.
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in (project_id, None)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+page_cache = PageCache(PAGE_CACHE_SIZE)
+
+
+async def project_version(db: AsyncSession, project_id: int):
+    return (await db.execute(
+        select(APProject.version, APProject.updated_at)
+        .filter(APProject.id == project_id).filter(APProject.is_deleted == False)
+    )).first()
+
+
+async def projects_version(db: AsyncSession):
+    # Archiving removes projects without bumping any version, and can even
+    # lower max(version), so the archive's high-water mark is part of it too.
+    row = (await db.execute(select(
+        func.coalesce(func.max(APProject.version), 0),
+        select(func.coalesce(func.max(ARCHIVED_PROJECTS.c.archive_id), 0)).scalar_subquery(),
+    ))).one()
+    return f"{row[0]}.{row[1]}"
+
+
+def not_modified(request: Request, etag: str, last_modified: datetime | None):
+    # The ETag is exact, so when the client sends one If-Modified-Since is
+    # ignored. Last-Modified only has one-second resolution: a row rewritten
+    # in the same second as the client's copy must not count as unchanged, so
+    # only a strictly later If-Modified-Since is a match.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified < parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def cached_page(request: Request, project_id: int | None, version: int | str, render,
+                      updated_at: datetime | None = None, media_type: str = "text/html"):
+    etag = f'W/"{version}-{templates_version()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = None
+    if updated_at is not None:
+        # updated_at is stored as naive UTC (SQLite's CURRENT_TIMESTAMP).
+        last_modified = updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    key = (project_id, request.url.path, request.url.query, version)
+    body = page_cache.get(key)
+    if body is None:
+        response = await render()
+        if response.status_code != 200:
+            return response
+        body = response.body
+        page_cache.set(key, body)
+
+    return Response(body, headers=headers, media_type=media_type)
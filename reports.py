@@ -0,0 +1,180 @@
+import csv
+import io
+import tempfile
+from openpyxl import Workbook
+from sqlalchemy import select, func, case, cast, Integer
+from sqlalchemy.orm import aliased
+from database import engine
+from models import APProject, Invoice, Transaction, POToVendor
+from archive import with_archived
+from duplicates import ledger_duplicates_query
+
+
+REPORT_BATCH_SIZE = 1000
+XLSX_CHUNK_SIZE = 64 * 1024
+
+REPORT_MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def report_models(include_archived: bool, *models):
+    # Reports read the hot tables unless asked to include archived projects.
+    if not include_archived:
+        return models
+    return [aliased(model, with_archived(model)) for model in models]
+
+
+def ledger_report(include_archived: bool = False):
+    project, vendor_po, invoice, transaction = report_models(include_archived, APProject, POToVendor, Invoice, Transaction)
+
+    return select(
+        project.quotation,
+        project.client,
+        vendor_po.vendor_po,
+        vendor_po.vendor,
+        invoice.invoice_type,
+        invoice.invoice_number,
+        transaction.date_paid,
+        transaction.dv_reference,
+        invoice.currency,
+        transaction.transaction_amount,
+    ).join(transaction.project.of_type(project)).join(transaction.invoices.of_type(invoice)).outerjoin(
+        transaction.vendor_po.of_type(vendor_po)
+    ).where(
+        transaction.is_deleted == False,
+        project.is_deleted == False,
+    ).order_by(transaction.project_id, transaction.date_paid, transaction.id)
+
+
+def project_report(include_archived: bool = False):
+    project, transaction = report_models(include_archived, APProject, Transaction)
+    paid = func.coalesce(func.sum(transaction.transaction_amount), 0)
+
+    return select(
+        project.quotation,
+        project.acceptance,
+        project.client,
+        project.currency,
+        project.total_po_amount,
+        paid.label('paid'),
+        (project.total_po_amount - paid).label('balance'),
+        func.count(transaction.id).label('transactions'),
+    ).outerjoin(
+        transaction, (transaction.project_id == project.id) & (transaction.is_deleted == False)
+    ).where(project.is_deleted == False).group_by(project.id).order_by(project.id)
+
+
+def vendor_report(include_archived: bool = False):
+    project, vendor_po, transaction = report_models(include_archived, APProject, POToVendor, Transaction)
+    paid_by_po = select(
+        transaction.vendor_po_id,
+        func.sum(transaction.transaction_amount).label('paid'),
+    ).where(transaction.is_deleted == False).group_by(transaction.vendor_po_id).subquery()
+    paid = func.coalesce(paid_by_po.c.paid, 0)
+
+    return select(
+        vendor_po.vendor,
+        vendor_po.currency,
+        func.count(vendor_po.id).label('purchase_orders'),
+        func.sum(vendor_po.po_amount).label('po_amount'),
+        func.sum(paid).label('paid'),
+        func.sum(vendor_po.po_amount - paid).label('balance'),
+    ).join(vendor_po.project.of_type(project)).outerjoin(paid_by_po, paid_by_po.c.vendor_po_id == vendor_po.id).where(
+        vendor_po.is_deleted == False,
+        project.is_deleted == False,
+    ).group_by(vendor_po.vendor, vendor_po.currency).order_by(vendor_po.vendor, vendor_po.currency)
+
+
+def aging_report(include_archived: bool = False):
+    project, vendor_po, invoice, transaction = report_models(include_archived, APProject, POToVendor, Invoice, Transaction)
+    paid_by_invoice = select(
+        transaction.invoice_id,
+        func.sum(transaction.transaction_amount).label('paid'),
+    ).where(transaction.is_deleted == False).group_by(transaction.invoice_id).subquery()
+    outstanding = invoice.invoice_amount - func.coalesce(paid_by_invoice.c.paid, 0)
+    age_days = cast(func.julianday('now') - func.julianday(invoice.created_at), Integer)
+
+    return select(
+        project.quotation,
+        project.client,
+        vendor_po.vendor_po,
+        vendor_po.vendor,
+        invoice.invoice_number,
+        invoice.currency,
+        invoice.invoice_amount,
+        outstanding.label('outstanding'),
+        age_days.label('age_days'),
+        case(
+            (age_days <= 30, '0-30'),
+            (age_days <= 60, '31-60'),
+            (age_days <= 90, '61-90'),
+            else_='90+',
+        ).label('bucket'),
+    ).join(invoice.project.of_type(project)).outerjoin(invoice.vendor_po.of_type(vendor_po)).outerjoin(
+        paid_by_invoice, paid_by_invoice.c.invoice_id == invoice.id
+    ).where(
+        invoice.is_deleted == False,
+        project.is_deleted == False,
+        outstanding > 0,
+    ).order_by(age_days.desc(), invoice.id)
+
+
+def duplicates_report(include_archived: bool = False):
+    # DV references are always matched against archived payments as well.
+    return ledger_duplicates_query()
+
+
+REPORTS = {
+    'ledger': ledger_report,
+    'project': project_report,
+    'vendor': vendor_report,
+    'aging': aging_report,
+    'duplicates': duplicates_report,
+}
+
+
+def iter_report_rows(report: str, include_archived: bool = False):
+    # A dedicated connection with stream_results reads the result through a
+    # server-side cursor in fixed-size batches instead of buffering it all.
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=REPORT_BATCH_SIZE).execute(REPORTS[report](include_archived))
+        yield list(result.keys())
+        for rows in result.partitions():
+            yield from rows
+
+
+def stream_csv(report: str, include_archived: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for index, row in enumerate(iter_report_rows(report, include_archived)):
+        writer.writerow(row)
+        if index % REPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def stream_xlsx(report: str, include_archived: bool = False):
+    # openpyxl's write-only mode spills rows to a temporary file as they are
+    # appended; the finished workbook is then streamed back in fixed chunks.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(report)
+    for row in iter_report_rows(report, include_archived):
+        sheet.append(list(row))
+
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(XLSX_CHUNK_SIZE):
+            yield chunk
+
+
+REPORT_WRITERS = {
+    'csv': stream_csv,
+    'xlsx': stream_xlsx,
+}
@@ -1,14 +1,25 @@
+import json
 from decimal import Decimal
-from fastapi import APIRouter, Depends, Request, HTTPException, Form, Response
-from models import APProject, Invoice, Transaction, POToVendor
-from database import SessionLocal
-from typing import Annotated, Optional
-from sqlalchemy.orm import Session
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, Request, HTTPException, Form, Response, Query, UploadFile, File
+from models import APProject, Invoice, Transaction, POToVendor, User
+from database import AsyncSessionLocal
+from search import search_records
+from reports import REPORT_MEDIA_TYPES, REPORT_WRITERS
+from importer import RowError, import_csv
+from duplicates import duplicate_payment_error, find_payment_duplicates
+from dashboard import build_dashboard, dashboard_version
+from archive import ARCHIVE_TABLES, ARCHIVED_PROJECTS, read_archived_project, with_archived
+from templating import templates
+from page_cache import cached_page, page_cache, project_version, projects_version
+from typing import Annotated, Optional, Literal
+from sqlalchemy import String, and_, func, insert, select, tuple_, type_coerce, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+from pydantic import BaseModel, Field, field_validator
 from starlette import status
-from fastapi.templating import Jinja2Templates
-from starlette.responses import RedirectResponse
-from datetime import date
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import RedirectResponse, StreamingResponse
+from datetime import date, datetime, timedelta
 
 router = APIRouter(
     prefix='/ap',
@@ -16,17 +27,17 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
-templates = Jinja2Templates(directory="./templates")
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_PAYMENTS = 500
+ARCHIVED_VENDOR_POS = ARCHIVE_TABLES['po_to_vendor']
 
 
 class ProjectRequest(BaseModel):
@@ -40,29 +51,257 @@ class ProjectRequest(BaseModel):
     fully_paid: bool = Field(default=False)
 
 
+class ProjectFilters(BaseModel):
+    currency: Optional[str] = Field(default=None, min_length=3, max_length=3)
+    is_paid: Optional[bool] = None
+    client: Optional[str] = Field(default=None, max_length=100)
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    cursor: Optional[str] = None
+    limit: int = Field(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    include_archived: bool = False
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def blank_as_none(cls, value):
+        # Empty filter inputs on the projects form are submitted as "".
+        return None if value == "" else value
+
+
+project_filters_dependency = Annotated[ProjectFilters, Query()]
+
+
+def created_fragment(request: Request, template: str, message: str, context: dict):
+    # Write endpoints answer with out-of-band swaps for just the rows and cards
+    # that changed, plus a showAlert event, instead of redirecting to a full page.
+    return templates.TemplateResponse(template, {"request": request, **context},
+                                      status_code=status.HTTP_201_CREATED,
+                                      headers={"HX-Trigger": json.dumps({"showAlert": {"message": message, "type": "success"}})})
+
+
+async def require_user(db: AsyncSession, user_id: int):
+    # There are no logins yet, so write forms name the user who records them.
+    if (await db.scalars(select(User.id).filter(User.id == user_id))).first() is None:
+        raise HTTPException(status_code=422, detail=f"User {user_id} not found")
+
+
 def redirect_to_projects_page():
     redirect_response = RedirectResponse(url="/ap/projects", status_code=status.HTTP_302_FOUND)
 
     return redirect_response
 
 
+def stored_timestamp(value: str):
+    # created_at is written by SQLite's CURRENT_TIMESTAMP ("YYYY-MM-DD HH:MM:SS"), so compare
+    # against plain strings instead of letting the DateTime type append microseconds.
+    return type_coerce(value, String)
+
+
+def encode_cursor(stored_created_at: str, project_id: int):
+    # The stored text as is: rows written by the ORM or bulk loads carry
+    # microseconds, and dropping them would skip or repeat rows at page breaks.
+    return f"{stored_created_at}_{project_id}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, project_id = cursor.rsplit("_", 1)
+        datetime.fromisoformat(created_at)
+        return stored_timestamp(created_at), int(project_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+async def query_project_page(db: AsyncSession, filters: ProjectFilters):
+    # Keyset pagination on (created_at, id), newest first, so every page costs
+    # the same no matter how deep into the listing the user scrolls.
+    project = aliased(APProject, with_archived(APProject)) if filters.include_archived else APProject
+    query = select(project).filter(project.is_deleted == False)
+
+    if filters.currency:
+        query = query.filter(project.currency == filters.currency.upper())
+    if filters.is_paid is not None:
+        query = query.filter(project.is_paid == filters.is_paid)
+    if filters.client:
+        query = query.filter(project.client.like(f"{filters.client}%"))
+    if filters.date_from:
+        query = query.filter(project.created_at >= stored_timestamp(filters.date_from.isoformat()))
+    if filters.date_to:
+        query = query.filter(project.created_at < stored_timestamp((filters.date_to + timedelta(days=1)).isoformat()))
+    if filters.cursor:
+        query = query.filter(tuple_(project.created_at, project.id) < tuple_(*decode_cursor(filters.cursor)))
+
+    rows = (await db.execute(
+        query.add_columns(type_coerce(project.created_at, String).label('stored_created_at'))
+        .order_by(project.created_at.desc(), project.id.desc()).limit(filters.limit + 1)
+    )).all()
+    projects = [row[0] for row in rows]
+
+    next_cursor = None
+    if len(projects) > filters.limit:
+        projects = projects[:filters.limit]
+        next_cursor = encode_cursor(rows[filters.limit - 1][1], projects[-1].id)
+
+    return projects, next_cursor
+
+
+async def archived_project_ids(db: AsyncSession, filters: ProjectFilters, projects: list):
+    # Archived rows in an include-archived listing link to /ap/archive/{id},
+    # since /ap/details only renders hot projects.
+    if not filters.include_archived or not projects:
+        return set()
+    return set(await db.scalars(
+        select(ARCHIVED_PROJECTS.c.id).where(ARCHIVED_PROJECTS.c.id.in_([project.id for project in projects]))
+    ))
+
+
+async def query_open_invoices(db: AsyncSession, vendor: str):
+    # Outstanding is summed per invoice through ix_transactions_invoice_id_amount,
+    # so a vendor's open invoices cost a few index seeks each, not a ledger scan.
+    paid = (select(func.coalesce(func.sum(Transaction.transaction_amount), 0))
+            .where(Transaction.invoice_id == Invoice.id)
+            .where(Transaction.is_deleted == False)
+            .correlate(Invoice)
+            .scalar_subquery())
+    outstanding = func.round(Invoice.invoice_amount - paid, 2)
+
+    return (await db.execute(
+        select(Invoice.id, Invoice.invoice_type, Invoice.invoice_number, Invoice.currency, Invoice.created_at,
+               APProject.quotation, APProject.client, POToVendor.vendor_po, outstanding.label("outstanding"))
+        .join(POToVendor, POToVendor.id == Invoice.vendor_po_id)
+        .join(APProject, APProject.id == Invoice.project_id)
+        .filter(POToVendor.vendor == vendor).filter(POToVendor.is_deleted == False)
+        .filter(Invoice.is_deleted == False).filter(APProject.is_deleted == False)
+        .filter(outstanding > 0)
+        .order_by(Invoice.created_at, Invoice.id)
+        .limit(MAX_BATCH_PAYMENTS)
+    )).all()
+
+
+async def apply_payments(db: AsyncSession, payments: list[dict], confirm_duplicate: bool = False):
+    # Balances are adjusted with relative single-statement UPDATEs guarded by
+    # "balance >= amount", so concurrent payments serialize on SQLite's write
+    # lock instead of overwriting each other's read-modify-write. The amounts
+    # are summed per PO and per project first, so a payment run costs one
+    # UPDATE per balance it touches, however many invoices it settles.
+    po_amounts, project_amounts, invoice_amounts = {}, {}, {}
+    for transaction_data in payments:
+        amount = transaction_data["transaction_amount"]
+        invoice_amounts[transaction_data["invoice_id"]] = invoice_amounts.get(transaction_data["invoice_id"], 0) + amount
+        if transaction_data["vendor_po_id"] is not None:
+            po_amounts[transaction_data["vendor_po_id"]] = po_amounts.get(transaction_data["vendor_po_id"], 0) + amount
+        project_amounts[transaction_data["project_id"]] = project_amounts.get(transaction_data["project_id"], 0) + amount
+
+    for vendor_po_id, amount in po_amounts.items():
+        new_po_balance = func.round(POToVendor.balance - amount, 2)
+        po_result = await db.execute(
+            update(POToVendor)
+            .where(POToVendor.id == vendor_po_id)
+            .where(POToVendor.is_deleted == False)
+            .where(POToVendor.balance >= amount)
+            .values(balance=new_po_balance, is_paid=new_po_balance == 0)
+            .execution_options(synchronize_session=False)
+        )
+        if po_result.rowcount != 1:
+            await db.rollback()
+            raise HTTPException(status_code=422, detail="Transaction amount is more than the PO balance")
+
+    for project_id, amount in project_amounts.items():
+        new_project_balance = func.round(APProject.balance - amount, 2)
+        project_result = await db.execute(
+            update(APProject)
+            .where(APProject.id == project_id)
+            .where(APProject.is_deleted == False)
+            .where(APProject.balance >= amount)
+            .values(balance=new_project_balance,
+                    total_paid=func.round(func.coalesce(APProject.total_paid, 0) + amount, 2),
+                    is_paid=new_project_balance == 0)
+            .execution_options(synchronize_session=False)
+        )
+        if project_result.rowcount != 1:
+            await db.rollback()
+            raise HTTPException(status_code=422, detail="Transaction amount is more than the project balance")
+
+    # The balance UPDATEs above hold SQLite's write lock, so two identical
+    # submissions cannot both pass the duplicate check.
+    for transaction_data in payments:
+        duplicate_error = duplicate_payment_error(await find_payment_duplicates(db, transaction_data), confirm_duplicate)
+        if duplicate_error:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail=duplicate_error)
+
+    # Payments made on different days or with other DVs are not duplicates,
+    # but together they still must not pay an invoice more than it is for.
+    invoice_totals = {row.id: row for row in await db.execute(
+        select(Invoice.id, Invoice.invoice_amount,
+               func.coalesce(func.sum(Transaction.transaction_amount), 0).label("paid"))
+        .outerjoin(Transaction, and_(Transaction.invoice_id == Invoice.id, Transaction.is_deleted == False))
+        .where(Invoice.id.in_(invoice_amounts))
+        .group_by(Invoice.id)
+    )}
+    for invoice_id, amount in invoice_amounts.items():
+        invoice = invoice_totals.get(invoice_id)
+        if invoice is None or Decimal(str(amount)) > Decimal(str(invoice.invoice_amount)) - Decimal(str(invoice.paid)):
+            await db.rollback()
+            raise HTTPException(status_code=422, detail="Transaction amount is more than the unpaid invoice amount")
+
+    # One executemany for the whole run; the rows are only rendered back from
+    # the submitted values, so no RETURNING round trip per row is needed.
+    await db.execute(insert(Transaction), payments)
+    await db.commit()
+    for project_id in project_amounts:
+        page_cache.invalidate(project_id)
+
+    return payments
+
+
+async def apply_payment(db: AsyncSession, transaction_data: dict, confirm_duplicate: bool = False):
+    return (await apply_payments(db, [transaction_data], confirm_duplicate))[0]
+
+
 ### Pages ###
 @router.get("/projects")
-async def render_ap_page(request: Request, db: db_dependency):
-    projects = db.query(APProject).filter(APProject.is_deleted == False).all()
+async def render_ap_page(request: Request, db: db_dependency, filters: project_filters_dependency):
+    async def render():
+        projects, next_cursor = await query_project_page(db, filters)
+        return templates.TemplateResponse("accounts-payable.html",
+                                          {"request": request, "projects": projects, "next_cursor": next_cursor,
+                                           "filters": filters,
+                                           "archived_ids": await archived_project_ids(db, filters, projects)})
+
+    return await cached_page(request, None, await projects_version(db), render)
+
 
-    return templates.TemplateResponse("accounts-payable.html", {"request": request, "projects": projects})
+@router.get("/projects/rows")
+async def render_ap_project_rows(request: Request, db: db_dependency, filters: project_filters_dependency):
+    async def render():
+        projects, next_cursor = await query_project_page(db, filters)
+        return templates.TemplateResponse("ap-project-rows.html",
+                                          {"request": request, "projects": projects, "next_cursor": next_cursor,
+                                           "filters": filters,
+                                           "archived_ids": await archived_project_ids(db, filters, projects)})
+
+    return await cached_page(request, None, await projects_version(db), render)
 
 
 @router.get("/details/{project_id}")
 async def render_project_details(request: Request, db: db_dependency, project_id: int):
-    project_model = db.query(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False).first()
+    version = await project_version(db, project_id)
 
-    if project_model is None:
+    if version is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
 
-    vendor_po_list = db.query(POToVendor).filter(POToVendor.project_id == project_id).filter(POToVendor.is_deleted == False).all()
-    return templates.TemplateResponse("ap-details.html", {"request": request, "project": project_model, "vendor_po_list": vendor_po_list})
+    async def render():
+        project_model = (await db.scalars(
+            select(APProject)
+            .options(selectinload(APProject.vendor_po.and_(POToVendor.is_deleted == False)))
+            .filter(APProject.id == project_id).filter(APProject.is_deleted == False)
+        )).first()
+        if project_model is None:
+            return templates.TemplateResponse("not-found.html", {"request": request}, status_code=404)
+        return templates.TemplateResponse("ap-details.html", {"request": request, "project": project_model, "vendor_po_list": project_model.vendor_po})
+
+    return await cached_page(request, project_id, version.version, render, version.updated_at)
 
 
 @router.get("/add-project-page")
@@ -72,78 +311,189 @@ async def render_add_project_page(request: Request):
 
 @router.get("/add-vendor-po-page/{project_id}")
 async def render_add_vendor_po_page(request: Request, db: db_dependency, project_id: int):
-    project_model = db.query(APProject).filter(APProject.id == project_id).first()
+    project_model = (await db.scalars(
+        select(APProject)
+        .options(selectinload(APProject.vendor_po.and_(POToVendor.is_deleted == False)))
+        .filter(APProject.id == project_id)
+    )).first()
 
     if project_model is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
 
-    return templates.TemplateResponse("ap-add-vendor-po.html", {"request": request, "project": project_model})
+    return templates.TemplateResponse("ap-add-vendor-po.html", {"request": request, "project": project_model, "vendor_po_list": project_model.vendor_po})
 
 
 @router.get("/add-transaction-page/{project_id}")
 async def render_add_transaction_page(request: Request, db: db_dependency, project_id: int):
-    invoice_list = db.query(Invoice).filter(Invoice.project_id == project_id).filter(Invoice.is_deleted == False).all()
-    project_model = db.query(APProject).filter(APProject.id == project_id).first()
+    project_model = (await db.scalars(
+        select(APProject)
+        .options(selectinload(APProject.invoices.and_(Invoice.is_deleted == False)),
+                 selectinload(APProject.transaction.and_(Transaction.is_deleted == False)))
+        .filter(APProject.id == project_id)
+    )).first()
     if project_model is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
     return templates.TemplateResponse("ap-add-transaction.html",
-                                      {"request": request, "project": project_model, "invoice_list": invoice_list})
+                                      {"request": request, "project": project_model, "invoice_list": project_model.invoices,
+                                       "transactions": project_model.transaction})
 
 
 @router.get("/transaction-history-page/{project_id}")
 async def render_transaction_history_page(request: Request, db: db_dependency, project_id: int):
-    project_model = db.query(APProject).filter(APProject.id == project_id).first()
+    version = await project_version(db, project_id)
 
-    if project_model is None:
+    if version is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
 
-    transaction_logs = db.query(Transaction).filter(Transaction.project_id == project_id).all()
-    return templates.TemplateResponse("ap-transaction-history.html",
-                                      {"request": request, "project": project_model, "transactions": transaction_logs})
+    async def render():
+        project_model = (await db.scalars(
+            select(APProject)
+            .options(selectinload(APProject.transaction.and_(Transaction.is_deleted == False)))
+            .filter(APProject.id == project_id)
+        )).first()
+        if project_model is None:
+            return templates.TemplateResponse("not-found.html", {"request": request}, status_code=404)
+        return templates.TemplateResponse("ap-transaction-history.html",
+                                          {"request": request, "project": project_model, "transactions": project_model.transaction})
+
+    return await cached_page(request, project_id, version.version, render, version.updated_at)
 
 
 @router.get("/record-invoice-page/{project_id}")
 async def render_record_invoice_page(request: Request, db: db_dependency, project_id: int):
-    vendor_po_list = db.query(POToVendor).filter(POToVendor.project_id == project_id).all()
-    project_model = db.query(APProject).filter(APProject.id == project_id).first()
+    project_model = (await db.scalars(
+        select(APProject)
+        .options(selectinload(APProject.vendor_po.and_(POToVendor.is_deleted == False)),
+                 selectinload(APProject.invoices.and_(Invoice.is_deleted == False)))
+        .filter(APProject.id == project_id)
+    )).first()
 
     if project_model is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
 
     return templates.TemplateResponse("ap-record-invoice.html",
-                                      {"request": request, "project": project_model, "vendor_po_list": vendor_po_list})
+                                      {"request": request, "project": project_model, "vendor_po_list": project_model.vendor_po,
+                                       "invoice_list": project_model.invoices})
 
 @router.get("/vendor-po-details-page/{vendor_po_id}")
 async def render_vendor_po_page(request: Request, db: db_dependency, vendor_po_id: int):
-    vendor_po_model = db.query(POToVendor).filter(POToVendor.is_deleted == False).filter(POToVendor.id == vendor_po_id).first()
+    vendor_po_model = (await db.scalars(
+        select(POToVendor)
+        .options(selectinload(POToVendor.invoices.and_(Invoice.is_deleted == False)))
+        .filter(POToVendor.is_deleted == False).filter(POToVendor.id == vendor_po_id)
+    )).first()
 
     if vendor_po_model is None:
         return templates.TemplateResponse("not-found.html", {"request": request})
 
-    invoice_list = db.query(Invoice).filter(Invoice.is_deleted == False).filter(Invoice.vendor_po_id == vendor_po_id).all()
+    return templates.TemplateResponse("ap-vendor-po-details.html", {"request": request, "po_to_vendor": vendor_po_model, "invoices": vendor_po_model.invoices})
+
+
+@router.get("/search-results")
+async def render_search_results(request: Request, db: db_dependency, q: str = Query(default="", max_length=100)):
+    results = await search_records(db, q)
+
+    return templates.TemplateResponse("search-results.html", {"request": request, "results": results, "q": q})
+
+
+@router.get("/batch-payment-page")
+async def render_batch_payment_page(request: Request, db: db_dependency, vendor: str = Query(default="", max_length=100)):
+    vendors = (await db.scalars(
+        select(POToVendor.vendor).distinct().filter(POToVendor.is_deleted == False).order_by(POToVendor.vendor)
+    )).all()
+    invoices = await query_open_invoices(db, vendor) if vendor else []
+
+    return templates.TemplateResponse("ap-batch-payment.html",
+                                      {"request": request, "vendors": vendors, "vendor": vendor, "invoices": invoices,
+                                       "max_payments": MAX_BATCH_PAYMENTS})
 
-    return templates.TemplateResponse("ap-vendor-po-details.html", {"request": request, "po_to_vendor": vendor_po_model, "invoices": invoice_list})
+
+@router.get("/dashboard")
+async def render_dashboard(request: Request, db: db_dependency):
+    today = date.today()
+    version, rates = await dashboard_version(db, today)
+
+    async def render():
+        dashboard = await build_dashboard(db, rates, today)
+        return templates.TemplateResponse("ap-dashboard.html", {"request": request, "dashboard": dashboard})
+
+    return await cached_page(request, None, version, render)
 
 
 ### Endpoints ###
 
-## TODO: Add search functionality
-## TODO: Add report generation
+@router.get("/search", status_code=status.HTTP_200_OK)
+async def search(db: db_dependency, q: str = Query(min_length=1, max_length=100)):
+    return await search_records(db, q)
+
+
+@router.get("/dashboard/data", status_code=status.HTTP_200_OK)
+async def read_dashboard(request: Request, db: db_dependency):
+    today = date.today()
+    version, rates = await dashboard_version(db, today)
+
+    async def render():
+        return Response(json.dumps(await build_dashboard(db, rates, today)), media_type="application/json")
+
+    return await cached_page(request, None, version, render, media_type="application/json")
+
+
+@router.get("/archive/{project_id}", status_code=status.HTTP_200_OK)
+async def read_archived(db: db_dependency, project_id: int):
+    record = await read_archived_project(db, project_id)
+
+    if record is None:
+        raise HTTPException(status_code=404, detail='Archived project not found')
+
+    return record
+
+
+@router.get("/reports/{report}", status_code=status.HTTP_200_OK)
+async def export_report(report: Literal["ledger", "project", "vendor", "aging", "duplicates"],
+                        file_format: Literal["csv", "xlsx"] = Query(default="csv", alias="format"),
+                        include_archived: bool = False):
+    suffix = "-with-archived" if include_archived else ""
+    filename = f"ap-{report}-report{suffix}-{date.today().isoformat()}.{file_format}"
+
+    return StreamingResponse(REPORT_WRITERS[file_format](report, include_archived),
+                             media_type=REPORT_MEDIA_TYPES[file_format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.post("/import/{kind}", status_code=status.HTTP_200_OK)
+async def import_records(kind: Literal["projects", "vendor_pos", "invoices", "transactions"],
+                         file: UploadFile = File(...),
+                         user_id: int = Form(...)):
+    # Parsing and validating a large file is CPU work, so it runs in the threadpool
+    # on the sync engine instead of on the event loop.
+    try:
+        return await run_in_threadpool(import_csv, file.file, kind, user_id)
+    except RowError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    finally:
+        page_cache.clear()
+
+
 @router.get("/", status_code=status.HTTP_200_OK)
-async def read_all(db: db_dependency):
-    return db.query(APProject).filter(APProject.is_deleted == False).all()
+async def read_all(response: Response, db: db_dependency, filters: project_filters_dependency):
+    projects, next_cursor = await query_project_page(db, filters)
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return projects
 
 @router.post("/add-project", status_code=status.HTTP_201_CREATED)
 async def add_project(
-        response: Response,
+        request: Request,
         db: db_dependency,
         client: str = Form(...),
         quotation: str = Form(...),
         acceptance: str = Form(...),
         currency: str = Form(...),
-        total_po_amount: Decimal = Form(...)
+        total_po_amount: Decimal = Form(...),
+        user_id: int = Form(...)
 ):
-    existing_project = db.query(APProject).filter(APProject.quotation == quotation).filter(APProject.is_deleted == False).first()
+    existing_project = (await db.scalars(select(APProject).filter(APProject.quotation == quotation).filter(APProject.is_deleted == False))).first()
     if existing_project:
         raise HTTPException(status_code=409, detail="Project already exists")
     project_data = {
@@ -154,44 +504,53 @@ async def add_project(
         "total_po_amount": total_po_amount,
         "total_paid": 0,
         "balance": total_po_amount,
+        "created_by_id": user_id,
+        "modified_by_id": user_id,
     }
 
     if total_po_amount <= 0:
         raise HTTPException(status_code=409, detail="Total PO amount must be greater than 0")
 
+    await require_user(db, user_id)
+
     project_model = APProject(**project_data)
     db.add(project_model)
-    db.commit()
+    await db.commit()
+    page_cache.invalidate()
 
-    response.headers["HX-Redirect"] = "/ap/projects"
-    return None
+    return created_fragment(request, "ap-project-created.html", "Project added", {"project": project_model})
 
 
 # TODO: Add error handling for isDeleted column
 
 @router.post("/add-vendor-po/{project_id}", status_code=status.HTTP_201_CREATED)
-async def add_vendor_po(response: Response,
+async def add_vendor_po(request: Request,
                         db: db_dependency,
                         project_id: int,
                         vendor_po: str = Form(...),
                         vendor: str = Form(...),
                         po_amount: Decimal = Form(...),
+                        user_id: int = Form(...)
                         ):
-    currency = db.query(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False).first().currency
+    currency = (await db.scalars(select(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False))).first().currency
     vendor_po_data = {
         "project_id": project_id,
         "vendor_po": vendor_po,
         "vendor": vendor,
         "po_amount": po_amount,
         "currency": currency,
-        "balance": po_amount
+        "balance": po_amount,
+        "created_by_id": user_id,
+        "modified_by_id": user_id,
     }
 
-    existing_vendor_po = db.query(POToVendor).filter(POToVendor.vendor_po == vendor_po).filter(POToVendor.is_deleted == False).first()
+    existing_vendor_po = (await db.scalars(select(POToVendor).filter(POToVendor.vendor_po == vendor_po).filter(POToVendor.is_deleted == False))).first()
+    # PO numbers stay taken after their project is archived.
+    archived_vendor_po = (await db.scalars(select(ARCHIVED_VENDOR_POS.c.id).filter(ARCHIVED_VENDOR_POS.c.vendor_po == vendor_po))).first()
 
-    total_project_balance = db.query(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False).first().balance
+    total_project_balance = (await db.scalars(select(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False))).first().balance
 
-    if existing_vendor_po:
+    if existing_vendor_po or archived_vendor_po:
         raise HTTPException(status_code=409, detail="Vendor already exists")
 
     if po_amount <= 0:
@@ -200,35 +559,40 @@ async def add_vendor_po(response: Response,
     if po_amount > total_project_balance:
         raise HTTPException(status_code=422, detail="PO amount is more than the balance")
 
+    await require_user(db, user_id)
+
     vendor_po_model = POToVendor(**vendor_po_data)
     db.add(vendor_po_model)
-    db.commit()
+    await db.commit()
+    page_cache.invalidate(project_id)
 
-    response.headers["HX-Redirect"] = f"/ap/details/{project_id}"
-    return None
+    return created_fragment(request, "ap-vendor-po-created.html", "Vendor PO added", {"vendor_po": vendor_po_model})
 
 
 @router.post("/record-invoice/{project_id}", status_code=status.HTTP_201_CREATED)
-async def add_invoice(response: Response,
+async def add_invoice(request: Request,
                       db: db_dependency,
                       project_id: int,
                       vendor_po_id: str = Form(...),
                       invoice_type: str = Form(...),
                       invoice_number: str = Form(...),
-                      invoice_amount: Decimal = Form(Decimal("0"))
+                      invoice_amount: Decimal = Form(Decimal("0")),
+                      user_id: int = Form(...)
                       ):
-    currency = db.query(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False).first().currency
+    currency = (await db.scalars(select(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False))).first().currency
     invoice_data = {
         "project_id": project_id,
         "vendor_po_id": vendor_po_id,
         "invoice_type": invoice_type,
         "invoice_number": invoice_number,
         "invoice_amount": invoice_amount,
-        "currency": currency
+        "currency": currency,
+        "created_by_id": user_id,
+        "modified_by_id": user_id,
     }
 
-    existing_invoice = db.query(Invoice).filter(Invoice.project_id == project_id).filter(Invoice.vendor_po_id == vendor_po_id).filter(Invoice.invoice_number == invoice_number).filter(Invoice.is_deleted == False).first()
-    total_po_balance = db.query(POToVendor).filter(POToVendor.project_id == project_id).filter(POToVendor.id == vendor_po_id).filter(POToVendor.is_deleted == False).first().balance
+    existing_invoice = (await db.scalars(select(Invoice).filter(Invoice.project_id == project_id).filter(Invoice.vendor_po_id == vendor_po_id).filter(Invoice.invoice_number == invoice_number).filter(Invoice.is_deleted == False))).first()
+    total_po_balance = (await db.scalars(select(POToVendor).filter(POToVendor.project_id == project_id).filter(POToVendor.id == vendor_po_id).filter(POToVendor.is_deleted == False))).first().balance
 
     if existing_invoice:
         raise HTTPException(status_code=409, detail="Invoice already exists")
@@ -239,79 +603,132 @@ async def add_invoice(response: Response,
     if invoice_amount > total_po_balance:
         raise HTTPException(status_code=422, detail="Invoice amount is more than the balance")
 
+    await require_user(db, user_id)
+
     invoice_model = Invoice(**invoice_data)
     db.add(invoice_model)
-    db.commit()
+    await db.commit()
+    page_cache.invalidate(project_id)
 
-    response.headers["HX-Redirect"] = f"/ap/details/{project_id}"
+    return created_fragment(request, "ap-invoice-created.html", "Invoice recorded", {"invoice": invoice_model})
 
 
-# TODO: Add error handling for negative transaction amounts
-# TODO: Add error handling for zero transaction amounts
-# TODO: Add error handling for DV-Reference not being unique
 # TODO: Add error handling for DV-Reference not being 11 characters long
-# TODO: Add error handling for transaction amount higher than po_amount
+# TODO: Add condition to subtract only if DV-Reference is not None.
+# TODO: If transaction amount == invoice amount, soft delete the invoice
 @router.post("/add-transaction/{project_id}", status_code=status.HTTP_201_CREATED)
-async def add_transaction(response: Response,
+async def add_transaction(request: Request,
                           db: db_dependency,
                           project_id: int,
                           invoice_id: int = Form(...),
                           transaction_amount: Decimal = Form(Decimal("0")),
                           dv_reference: str = Form(...),
-                          date_paid: date = Form(date.today())
+                          date_paid: date = Form(date.today()),
+                          confirm_duplicate: bool = Form(False),
+                          user_id: int = Form(...)
                           ):
-    project_model = db.query(APProject).filter(APProject.id == project_id).first()
-    vendor_po_model = db.query(POToVendor).filter(POToVendor.project_id == project_id).first()
-    if project_model is None:
-        raise HTTPException(status_code=404, detail='Project not found')
+    if transaction_amount <= 0:
+        raise HTTPException(status_code=422, detail="Transaction amount must be greater than 0")
 
+    await require_user(db, user_id)
 
-    vendor_po_id = db.query(POToVendor).filter(POToVendor.project_id == project_id).filter(POToVendor.is_deleted == False).first().id
+    invoice_row = (await db.execute(select(Invoice.vendor_po_id).filter(Invoice.id == invoice_id).filter(Invoice.project_id == project_id).filter(Invoice.is_deleted == False))).first()
+    if invoice_row is None:
+        raise HTTPException(status_code=404, detail='Invoice not found')
 
     transaction_data = {
         "transaction_amount": transaction_amount,
         "dv_reference": dv_reference,
         "date_paid": date_paid,
         "project_id": project_id,
-        "vendor_po_id": vendor_po_id,
+        "vendor_po_id": invoice_row.vendor_po_id,
         "invoice_id": invoice_id,
+        "created_by_id": user_id,
     }
-    try:
-        # vendor_po_model.balance = vendor_po_model.po_amount - transaction_amount
-    ## TODO: Add condition to subtract only if DV-Reference is not None.
-    ## TODO: Add error handling when balance is lower than invoice amount.
-    ## TODO: Add error handling to prevent negative balance.
-    # TODO: If transaction amount == invoice amount, soft delete the invoice
-        project_model.balance -= transaction_amount
-        vendor_po_model.balance -= transaction_amount
-        project_model.total_paid += transaction_amount
-        project_model.balance = project_model.total_po_amount - project_model.total_paid
-
-        if vendor_po_model.balance == 0:
-            vendor_po_model.is_paid = True
-        else:
-            vendor_po_model.is_paid = False
-
-        if project_model.balance == 0:
-            project_model.fully_paid = True
-        else:
-            project_model.fully_paid = False
-
-    except (ValueError, TypeError, ArithmeticError):
-        raise HTTPException(status_code=400, detail='Invalid amount')
-
-    transaction_model = Transaction(**transaction_data)
-    db.add(transaction_model)
-    db.add(project_model)
-    db.commit()
-
-    response.headers["HX-Redirect"] = f"/ap/details/{project_model.id}"
+    await apply_payment(db, transaction_data, confirm_duplicate)
+    project_model = await db.get(APProject, project_id)
+
+    return created_fragment(request, "ap-transaction-created.html", "Payment recorded",
+                            {"transaction": transaction_data, "project": project_model})
+
+
+@router.post("/batch-payment", status_code=status.HTTP_201_CREATED)
+async def add_batch_payment(request: Request,
+                            db: db_dependency,
+                            user_id: int = Form(...),
+                            invoice_id: list[int] = Form(...),
+                            transaction_amount: list[Decimal] = Form(...),
+                            dv_reference: list[str] = Form(...),
+                            date_paid: Optional[date] = Form(None),
+                            vendor: Optional[str] = Form(None),
+                            confirm_duplicate: bool = Form(False)
+                            ):
+    # A whole payment run is checked against balances loaded in one query
+    # before anything is written, then recorded by apply_payments in a single
+    # transaction: either every payment in the run is recorded or none is.
+    if not len(invoice_id) == len(transaction_amount) == len(dv_reference):
+        raise HTTPException(status_code=422, detail="Every payment needs an invoice, an amount and a DV reference")
+
+    if len(invoice_id) > MAX_BATCH_PAYMENTS:
+        raise HTTPException(status_code=422, detail=f"A payment run can settle at most {MAX_BATCH_PAYMENTS} invoices")
+
+    if any(amount <= 0 for amount in transaction_amount):
+        raise HTTPException(status_code=422, detail="Transaction amount must be greater than 0")
+
+    seen_references, seen_payments = set(), set()
+    for invoice, amount, reference in zip(invoice_id, transaction_amount, dv_reference):
+        if reference in seen_references:
+            raise HTTPException(status_code=409, detail=f"Duplicate payment: DV {reference} is used twice in this run")
+        if (invoice, amount) in seen_payments:
+            raise HTTPException(status_code=409, detail=f"Duplicate payment: DV {reference} pays the same invoice and amount twice")
+        seen_references.add(reference)
+        seen_payments.add((invoice, amount))
+
+    await require_user(db, user_id)
+
+    invoice_rows = {row.id: row for row in (await db.execute(
+        select(Invoice.id, Invoice.project_id, Invoice.vendor_po_id, APProject.quotation,
+               APProject.balance.label("project_balance"), POToVendor.vendor_po, POToVendor.balance.label("po_balance"))
+        .join(APProject, and_(APProject.id == Invoice.project_id, APProject.is_deleted == False))
+        .outerjoin(POToVendor, and_(POToVendor.id == Invoice.vendor_po_id, POToVendor.is_deleted == False))
+        .filter(Invoice.id.in_(set(invoice_id))).filter(Invoice.is_deleted == False)
+    )).all()}
+
+    payments, po_totals, project_totals = [], {}, {}
+    for invoice, amount, reference in zip(invoice_id, transaction_amount, dv_reference):
+        invoice_row = invoice_rows.get(invoice)
+        if invoice_row is None or (invoice_row.vendor_po_id is not None and invoice_row.vendor_po is None):
+            raise HTTPException(status_code=404, detail=f"Invoice {invoice} not found")
+        if invoice_row.vendor_po_id is not None:
+            po_totals[invoice_row.vendor_po_id] = po_totals.get(invoice_row.vendor_po_id, 0) + amount
+        project_totals[invoice_row.project_id] = project_totals.get(invoice_row.project_id, 0) + amount
+        payments.append({
+            "transaction_amount": amount,
+            "dv_reference": reference,
+            "date_paid": date_paid or date.today(),
+            "project_id": invoice_row.project_id,
+            "vendor_po_id": invoice_row.vendor_po_id,
+            "invoice_id": invoice,
+            "created_by_id": user_id,
+        })
+
+    for invoice_row in invoice_rows.values():
+        if invoice_row.vendor_po_id is not None and po_totals[invoice_row.vendor_po_id] > invoice_row.po_balance:
+            raise HTTPException(status_code=422, detail=f"Payments to PO {invoice_row.vendor_po} are more than its balance of {invoice_row.po_balance:.2f}")
+        if project_totals[invoice_row.project_id] > invoice_row.project_balance:
+            raise HTTPException(status_code=422, detail=f"Payments on project {invoice_row.quotation} are more than its balance of {invoice_row.project_balance:.2f}")
+
+    await apply_payments(db, payments, confirm_duplicate)
+    invoices = await query_open_invoices(db, vendor) if vendor else None
+
+    return created_fragment(request, "ap-batch-payment-created.html", f"{len(payments)} payments recorded",
+                            {"transactions": payments, "invoices": invoices})
 
 
 @router.put("/delete-project/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_project(db: db_dependency, project_id: int):
 
-    project_model = db.query(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False).first()
+    project_model = (await db.scalars(select(APProject).filter(APProject.id == project_id).filter(APProject.is_deleted == False))).first()
 
     if project_model is None:
         raise HTTPException(status_code=404, detail='Project not found')
@@ -319,4 +736,5 @@ async def delete_project(db: db_dependency, project_id: int):
     project_model.is_deleted = True
 
     db.add(project_model)
-    db.commit()
\ No newline at end of file
+    await db.commit()
+    page_cache.invalidate(project_id)
\ No newline at end of file
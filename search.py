@@ -0,0 +1,119 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+SEARCH_RESULT_LIMIT = 20
+
+# Each indexed table gets its own slot in the FTS rowid (id * 4 + slot) so the
+# triggers can remove a record's entry by rowid instead of scanning the index.
+INDEXED_TABLES = {
+    'project': {
+        'slot': 0,
+        'table': 'ap_projects',
+        'columns': 'quotation, acceptance, client',
+        'project_id': 'new.id',
+        'reference': "coalesce(new.quotation, '') || ' ' || coalesce(new.acceptance, '')",
+        'detail': 'new.client',
+    },
+    'vendor_po': {
+        'slot': 1,
+        'table': 'po_to_vendor',
+        'columns': 'vendor_po, vendor, project_id',
+        'project_id': 'new.project_id',
+        'reference': 'new.vendor_po',
+        'detail': 'new.vendor',
+    },
+    'invoice': {
+        'slot': 2,
+        'table': 'invoices',
+        'columns': 'invoice_number, invoice_type, project_id',
+        'project_id': 'new.project_id',
+        'reference': 'new.invoice_number',
+        'detail': 'new.invoice_type',
+    },
+    'transaction': {
+        'slot': 3,
+        'table': 'transactions',
+        'columns': 'dv_reference, project_id',
+        'project_id': 'new.project_id',
+        'reference': 'new.dv_reference',
+        'detail': "''",
+    },
+}
+
+SEARCH_LINKS = {
+    'project': '/ap/details/{project_id}',
+    'vendor_po': '/ap/vendor-po-details-page/{record_id}',
+    'invoice': '/ap/details/{project_id}',
+    'transaction': '/ap/transaction-history-page/{project_id}',
+}
+
+
+def _index_statements(kind: str, spec: dict):
+    table = spec['table']
+    insert = (f"INSERT INTO search_index (rowid, kind, record_id, project_id, reference, detail) "
+              f"SELECT new.id * 4 + {spec['slot']}, '{kind}', new.id, {spec['project_id']}, "
+              f"{spec['reference']}, {spec['detail']} WHERE new.is_deleted = 0;")
+    delete = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {spec['slot']};"
+
+    # Balance updates on every payment must not touch the index, so the update
+    # trigger only fires for the searchable columns and the soft-delete flag.
+    yield (f"CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} "
+           f"BEGIN {insert} END")
+    yield (f"CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE OF {spec['columns']}, is_deleted "
+           f"ON {table} BEGIN {delete} {insert} END")
+    yield (f"CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} "
+           f"BEGIN {delete} END")
+
+
+def _backfill_statement(kind: str, spec: dict):
+    select = (f"SELECT new.id * 4 + {spec['slot']}, '{kind}', new.id, {spec['project_id']}, "
+              f"{spec['reference']}, {spec['detail']} FROM {spec['table']} AS new WHERE new.is_deleted = 0")
+    return f"INSERT INTO search_index (rowid, kind, record_id, project_id, reference, detail) {select}"
+
+
+def create_search_index(engine: Engine):
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")
+        ).first()
+
+        if not exists:
+            # tokenchars keeps references such as QKPH-1234-5678 as a single token,
+            # and the prefix indexes make search-as-you-type lookups index-only.
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE search_index USING fts5("
+                "kind UNINDEXED, record_id UNINDEXED, project_id UNINDEXED, reference, detail, "
+                "tokenize = \"unicode61 tokenchars '-'\", prefix = '2 3 4')"
+            ))
+            for kind, spec in INDEXED_TABLES.items():
+                connection.execute(text(_backfill_statement(kind, spec)))
+
+        for kind, spec in INDEXED_TABLES.items():
+            for statement in _index_statements(kind, spec):
+                connection.execute(text(statement))
+
+
+def build_match_query(q: str):
+    terms = [term.replace('"', '') for term in q.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+async def search_records(db: AsyncSession, q: str, limit: int = SEARCH_RESULT_LIMIT):
+    match_query = build_match_query(q)
+    if not match_query:
+        return []
+
+    rows = (await db.execute(text(
+        "SELECT s.kind, s.record_id, s.project_id, s.reference, s.detail "
+        "FROM search_index AS s "
+        "JOIN ap_projects AS p ON p.id = s.project_id AND p.is_deleted = 0 "
+        "WHERE s.search_index MATCH :match_query "
+        "ORDER BY s.rank LIMIT :limit"
+    ), {"match_query": match_query, "limit": limit})).mappings().all()
+
+    return [
+        {**row, "url": SEARCH_LINKS[row["kind"]].format(**row)}
+        for row in rows
+    ]
@@ -0,0 +1,36 @@
+import hashlib
+import os
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from metrics import TimedTemplate
+
+
+# One shared environment for every router. Compiled templates are kept in
+# memory and their bytecode on disk, so a restarted worker skips the Jinja
+# compile step; templates are only re-checked on disk when reloading is on.
+templates = Jinja2Templates(directory="./templates")
+templates.env.template_class = TimedTemplate
+templates.env.bytecode_cache = FileSystemBytecodeCache(os.environ.get('APAR_TEMPLATE_CACHE_DIR'))
+templates.env.auto_reload = os.environ.get('APAR_TEMPLATE_RELOAD') == '1'
+
+
+def precompile_templates():
+    for name in templates.env.list_templates(extensions=['html']):
+        templates.env.get_template(name)
+
+
+def _hash_templates():
+    digest = hashlib.sha256()
+    for name in sorted(templates.env.list_templates()):
+        source, _, _ = templates.env.loader.get_source(templates.env, name)
+        digest.update(f"{name}\0{source}\0".encode())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_HASH = _hash_templates()
+
+
+def templates_version():
+    # Part of every page ETag, so a deploy that changes the markup invalidates
+    # what browsers hold even when the data behind the page has not changed.
+    return _hash_templates() if templates.env.auto_reload else TEMPLATES_HASH